@@ -1,108 +1,448 @@
 from __future__ import annotations
 
+import codecs
 import glob
+import io
+import itertools
+import locale
 import logging
+import mmap
+import operator
+import os
 import re
 import sys
-from typing import Generator
+import time
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Generator,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import duckdb
-from pypika import Column, Query, Schema, Table
+from .checkpoint import Checkpoints, locate, skip, tail
+from .compress import compression, decompress
+from .index import Index
+from .stats import Stats
+from .util import Arena, Batch, Log, Memory
 
-from .util import Log, Memory
+if TYPE_CHECKING:
+    import duckdb
+
+    from .writer import Writer
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def lines_of(text: str, max_size: int) -> List[str]:
+    # a trailing newline doesn't start another line
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    if len(lines) > 0 and max(map(len, lines)) > max_size:
+        lines = [line[:max_size] for line in lines]
+    return lines
+
+
+def blocks(buf, start: int, end: int, max_size: int) -> Iterator[List[str]]:
+    """
+    Splits lines of `buf[start:end]` in blocks aligned to newlines and yields the lines of each
+    block. A block is decoded at once, invalid bytes are replaced, and lines are truncated to
+    `max_size` characters as the text reader does.
+    """
+    while start < end:
+        stop = min(start + BLOCK_SIZE, end)
+        if stop < end:
+            stop = buf.find(b"\n", stop, end) + 1 or end
+        yield lines_of(buf[start:stop].decode("utf-8", errors="replace"), max_size)
+        start = stop
+
+
+def split(buf, start: int, end: int, max_size: int) -> Iterator[str]:
+    for lines in blocks(buf, start, end, max_size):
+        yield from lines
+
+
+def stream(
+    read: Callable[[int], bytes], max_size: int, decoder=None
+) -> Iterator[List[str]]:
+    """
+    Splits lines of a stream read in blocks and yields the lines of each block, at most one block
+    and a truncated partial line is held. Bytes are decoded as UTF-8 with invalid ones replaced,
+    unless an incremental `decoder` is given.
+    """
+    if decoder is None:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    rest = ""
+    while True:
+        block = read(BLOCK_SIZE)
+        text = rest + decoder.decode(block, final=not block)
+        if not block:
+            if text:
+                yield lines_of(text, max_size)
+            return
+
+        cut = text.rfind("\n") + 1
+        if cut == 0:
+            rest = text[:max_size]
+            continue
+
+        yield lines_of(text[:cut], max_size)
+        rest = text[cut:]
 
 
 class Sink:
-    def __init__(self, path: str, max_size: int = 512):
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 512,
+        reader: str = "text",
+        checkpoints: Optional[Checkpoints] = None,
+    ):
         self.path = path
         self.max_size = max_size
-        self.buffer = []
+        self.reader = reader
+        self.checkpoints = checkpoints
+        # offset to start from, offset to end at and line number before the start of each file
+        self.ranges: Dict[str, Tuple[int, Optional[int], int]] = {}
+        # file, compression, start and line number before the start of the file being read
+        self.reading = None
+        self.consumed = 0
+        self.offset = 0
+        self.buffer = Arena()
+        self.source = None
+        # lines of the block being read, line numbers are counted back from its end when needed
+        self.block = None
+        self.lineno = None
+        # number of patterns the current line was matched against before it was recycled
+        self.generation = 0
+        self.decompressed = {}
+        # miners holding logs read from the sink, checkpoints stop before the oldest of them
+        self.holders = []
+        # byte range `ParallelMatch` yields logs of, it is written as a whole
+        self.chunk = None
 
-    def __iter__(self):
+    @property
+    def lineno(self) -> Optional[int]:
+        if self.block is not None:
+            return self.consumed - operator.length_hint(self.block)
+        return self._lineno
+
+    @lineno.setter
+    def lineno(self, lineno: Optional[int]):
+        self._lineno = lineno
+
+    def files(self) -> List[str]:
         files = glob.glob(self.path)
         logging.info(f"detect log files: {files}")
+        if self.checkpoints is not None:
+            # every file is checked before any is read, a rotated file is found by its old name
+            files = [file for file in files if self._range(file)]
+        return files
+
+    def _range(self, file: str) -> bool:
+        start, lineno, unchanged = self.checkpoints.start(file)
+        if unchanged:
+            return False
+        end = None
+        if compression(file) is None:
+            end = os.path.getsize(file)
+            settled = self.checkpoints.settled(file)
+            start = skip(file, start)
+            if not settled:
+                # only complete lines, the last one might still be written
+                end = tail(file, start, end)
+            if end == start:
+                return False
+        self.ranges[file] = (start, end, lineno)
+        return True
+
+    def range(self, file: str) -> Tuple[int, Optional[int], int]:
+        """
+        Returns the offset to start from, the offset to end at, None for compressed files, and the
+        line number before the start.
+        """
+        if file in self.ranges:
+            return self.ranges[file]
+        if compression(file) is not None:
+            return 0, None, 0
+        return 0, os.path.getsize(file), 0
+
+    def read(self, file: str):
+        self.source = file
+        self.generation = 0
+        start, end, base = self.range(file)
+        codec = compression(file)
+        if codec is not None:
+            blocks = self._decompress(file, codec, start)
+        elif self.reader == "mmap" or start > 0:
+            # resumed ranges are read in bytes
+            blocks = self._mmap(file, start, end)
+        else:
+            blocks = self._text(file, end)
+
+        self.reading, self.consumed = (file, codec, start, base), base
+        self.lineno = base
+        # lines are counted by block, a line number is only known once it is asked for
+        for lines in blocks:
+            self.consumed += len(lines)
+            self.block = iter(lines)
+            yield from self.block
+        self.block = None
+        self.lineno = self.consumed
+        self.reading = None
+        self.done(file, end if codec is None else self.offset, self.consumed, True)
+        if codec is None:
+            end = os.path.getsize(file) if end is None else end
+        Stats().count("bytes", (end if codec is None else self.offset) - start)
+
+    def done(self, file: str, offset: int, lineno: int, complete: bool):
+        if self.checkpoints is not None:
+            if complete and compression(file) is None:
+                # a partial last line is read once the file is settled
+                complete = offset == os.path.getsize(file)
+            self.checkpoints.done(file, offset, lineno, complete)
+
+    def held(self) -> Dict[str, int]:
+        """
+        Returns the oldest line number of each file which is recycled or held by a miner, it isn't
+        written yet.
+        """
+        held = {}
+        origins = [self.buffer.origins(), *(holder.held() for holder in self.holders)]
+        for source, lineno in itertools.chain(*origins):
+            if source is not None and lineno is not None:
+                held[source] = min(held.get(source, lineno), lineno)
+        return held
+
+    def checkpoint(self):
+        """
+        Commits offsets of logs read so far, call it once they are written. A file is committed up to
+        the oldest of its logs which is still held, later ones might be read again.
+        """
+        if self.checkpoints is None:
+            return
+        held = self.held()
+        if self.reading is not None:
+            file, codec, start, base = self.reading
+            read = self.lineno
+            lineno = min(read, held.pop(file, read + 1) - 1)
+            self.done(file, locate(file, codec, start, lineno - base), lineno, False)
+        for file, lineno in held.items():
+            checkpoint = self.checkpoints.pending.get(file)
+            if checkpoint is None or checkpoint["lineno"] < lineno:
+                continue
+            start, _, base = self.range(file)
+            offset = locate(file, compression(file), start, lineno - 1 - base)
+            self.done(file, offset, lineno - 1, False)
+        self.checkpoints.commit()
+
+    def _decompress(self, file: str, codec: str, start: int = 0):
+        size, elapsed = self.decompressed.get(codec, (0, 0.0))
+
+        with decompress(file, codec) as f:
+            if start > 0:
+                f.seek(start)
+
+            def read(n: int) -> bytes:
+                nonlocal size, elapsed
+                started = time.perf_counter()
+                block = f.read(n)
+                elapsed += time.perf_counter() - started
+                size += len(block)
+                return block
+
+            yield from stream(read, self.max_size)
+            self.offset = f.tell()
+
+        self.decompressed[codec] = (size, elapsed)
+        logging.info(
+            f"decompressed {file}, {codec} logs are read at "
+            f"{format(size / 1024 / 1024 / max(elapsed, 1e-9), '.2f')}MB/s so far."
+        )
+
+    def _text(self, file: str, end: Optional[int] = None):
+        # decoded as a text file, newlines are translated, up to the byte offset `end`
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(locale.getpreferredencoding(False))(
+                errors="replace"
+            ),
+            translate=True,
+        )
+        with open(file, "rb") as f:
+
+            def read(n: int) -> bytes:
+                return f.read(n if end is None else min(n, end - f.tell()))
+
+            yield from stream(read, self.max_size, decoder)
+
+    def _mmap(self, file: str, start: int = 0, end: Optional[int] = None):
+        with open(file, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                yield from blocks(
+                    buf, start, size if end is None else end, self.max_size
+                )
+
+    def __iter__(self):
+        files = self.files()
 
         def f():
             for file in files:
-                with open(file, "r") as f:
-                    for line in f:
-                        yield line[:-1][: self.max_size]
+                yield from self.read(file)
+
+        yield from self.drain(f())
 
+    def drain(self, lines):
         def b():
             while len(self.buffer) != 0:
-                line = self.buffer.pop()
+                line, self.source, self.lineno, self.generation = self.buffer.pop()
                 yield line
-
-        file = f()
+            self.generation = 0
 
         while True:
             buf = b()
             yield from buf
-            yield from file
+            yield from lines
             yield None
             if len(self.buffer) == 0:
                 break
 
-    def send(self, lines):
-        self.buffer += lines
+    def send(self, lines, origins=None, generations=None):
+        if origins is None:
+            origins = [(None, None)] * len(lines)
+        if generations is None:
+            generations = [0] * len(lines)
+        for line, (source, lineno), generation in zip(lines, origins, generations):
+            self.buffer.append(line, source, lineno, generation)
+        Stats().peak("recycle buffer", len(self.buffer))
 
 
-Memory().serialize(re.Pattern, lambda p: p.pattern)
+Memory.serialize(re.Pattern, lambda p: p.pattern)
 
 
 class Match:
-    def __init__(self, memory: Memory, sink: Sink):
+    def __init__(
+        self, memory: Memory, sink: Sink, patterns: Optional[List[re.Pattern]] = None
+    ):
         self.sink = sink
-        self.patterns = memory.load("patterns", [])
-        for offset in range(0, len(self.patterns)):
-            self.patterns[offset] = re.compile(self.patterns[offset])
+        self.memory = memory
+        # the most matched patterns are tried first, unless patterns of another match are given
+        if patterns is None:
+            patterns = [re.compile(p) for p in memory.patterns()]
+        self.patterns = patterns
+        self.hits = memory.hits
+        self.index = Index(self.patterns)
+        # costs of patterns are sampled while measuring
+        self.stats = Stats() if Stats().enabled else None
+        self.origin = (None, None)
+        # number of patterns the last yielded line was matched against
+        self.generation = 0
 
     def __iter__(self):
-        for line in self.sink:
+        yield from self._match(Stats().timed("read", self.sink))
+
+    def _match(self, lines):
+        sink = self.sink
+        for line in lines:
             if line is None:
                 yield None
                 continue
 
-            for regex in self.patterns:
-                match = regex.match(line)
-                if match is None:
-                    continue
-                yield Log(regex.pattern, line, match.groups())
-                break
-            else:
+            # recycled lines were matched against older patterns already
+            log = self.match(line, start=sink.generation)
+            if log is None:
+                # only lines left to the miner need their origin and generation
+                self.origin = (sink.source, sink.lineno)
+                self.generation = len(self.patterns)
                 yield line
+            else:
+                yield log
+
+    def match(
+        self, line: str, origin: Optional[Tuple] = None, start: int = 0
+    ) -> Optional[Log]:
+        """
+        Returns the log of the first pattern matching `line` from the `start` generation, its origin
+        is the line the sink yielded last unless given.
+        """
+        if self.stats is not None and self.stats.sampled():
+            started = time.perf_counter()
+            found = self.index.match(line, start=start)
+            self.stats.cost(found and found[0].pattern, time.perf_counter() - started)
+        else:
+            found = self.index.match(line, start=start)
+        if found is None:
+            return None
+
+        regex, match = found
+        self.hits[regex.pattern] += 1
+        if origin is None:
+            return Log(
+                regex.pattern, line, match.groups(), self.sink.source, self.sink.lineno
+            )
+        return Log(regex.pattern, line, match.groups(), *origin)
 
     def send(self, pattern: re.Pattern):
         self.patterns.append(pattern)
+        self.index.add(pattern)
+        self.memory.learn(pattern.pattern)
 
 
 def collect(
-    logs: Generator[Log, None, None],
+    logs: Generator[Union[Log, Batch], None, None],
     max_lines: int,
     db_file: str = ":default:",
+    batch_size: int = 8192,
+    infer_rows: int = 1024,
+    parquet: Optional[str] = None,
+    partition_by: Optional[str] = None,
+    writer: Optional[Writer] = None,
+    sink: Optional[Sink] = None,
 ) -> duckdb.DuckDBPyConnection:
+    """
+    Loads logs into a table per template of the DuckDB `db_file`, or into Parquet datasets under
+    the `parquet` directory, see `ParquetWriter`. A `writer` kept across calls is written to
+    instead. Chunks of the `sink` matched by `ParallelMatch` are written as a whole, past
+    `max_lines` if need be, so the sink is checkpointed between them. Returns the DuckDB
+    connection to query them.
+    """
+    import duckdb
+
+    from .writer import ParquetWriter, Writer, report
+
     if max_lines <= 0:
         max_lines = sys.maxsize
 
-    db = duckdb.connect(db_file)
-
-    for line, _ in zip(logs, range(max_lines)):
-        schema = Schema("information_schema")
-        table = db.execute(
-            Query.from_(schema.tables)
-            .select("*")
-            .where(schema.tables.table_name == line.pattern)
-            .get_sql()
-        ).fetchone()
-        if table is None:
-            columns = [Column(f"c{id}", "string") for id in range(0, len(line.groups))]
-            db.sql(
-                Query.create_table(line.pattern.replace('"', '""'))
-                .columns(*columns)
-                .get_sql()
-            )
+    if writer is None and parquet is None:
+        writer = Writer(
+            duckdb.connect(db_file), batch_size=batch_size, infer_rows=infer_rows
+        )
+    elif writer is None:
+        writer = ParquetWriter(
+            parquet, partition_by, batch_size=batch_size, infer_rows=infer_rows
+        )
 
-        table = Table(line.pattern.replace('"', '""'))
-        db.sql(Query.into(table).insert(*line.groups).get_sql())
+    started, before = time.perf_counter(), writer.rows
+    with Stats().stage("collect"):
+        for log in Stats().timed("extract", logs):
+            if isinstance(log, Batch):
+                if sink is None:
+                    log = log.head(max_lines - (writer.rows - before))
+                writer.extend(log)
+            else:
+                writer.append(log)
+            if writer.rows - before >= max_lines and (
+                sink is None or sink.chunk is None
+            ):
+                break
+        writer.flush()
+    report(writer.rows - before, started)
 
-    return db
+    return writer.db
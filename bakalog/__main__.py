@@ -1,17 +1,31 @@
+import json
 import logging
 import os
+import shutil
+import signal
 from glob import glob
 
 import click
-import openai
-from IPython import embed
-from rich.logging import RichHandler
 
-from bakalog import Match, Sink, collect
-from bakalog.cluster import Cluster
-from bakalog.extract import extract
+from bakalog import Match, Sink, client, collect
+from bakalog.checkpoint import Checkpoints
+from bakalog.client import SOCKET
 from bakalog.util import Memory, parse_size
 
+# heavy dependencies are imported by the commands which need them, the same default as openai
+API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+
+def configure_logging():
+    from rich.logging import RichHandler
+
+    logging.basicConfig(
+        level="INFO",
+        format="%(message)s",
+        datefmt="[%X]",
+        handlers=[RichHandler()],
+    )
+
 
 @click.group()
 def main():
@@ -24,14 +38,20 @@ def main():
 def clean():
     files = glob(f"{Memory.PATH}/*")
     for f in files:
-        os.remove(f)
+        if f == SOCKET:
+            # of a running `bakalog serve`
+            continue
+        if os.path.isdir(f):
+            shutil.rmtree(f)
+        else:
+            os.remove(f)
 
 
 @main.command()
 @click.argument("file")
 @click.option(
     "--gpt-base",
-    default=openai.api_base,
+    default=API_BASE,
     help="OpenAI API base.",
     show_default=True,
 )
@@ -62,35 +82,856 @@ def clean():
     type=float,
     show_default=True,
 )
-def run(file, gpt_base, max_lines, buf_size, max_len, threshold):
+@click.option(
+    "--batch-size",
+    default=8192,
+    help="Number of rows of each template buffered before bulk loading into DuckDB.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--workers",
+    default=1,
+    help="Number of processes matching logs with learned patterns.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--reader",
+    default="text",
+    type=click.Choice(["text", "mmap"]),
+    help="How log files are read, `mmap` splits memory-mapped files in blocks, `text` translates newlines as text files do.",
+    show_default=True,
+)
+@click.option(
+    "--dedup/--no-dedup",
+    default=True,
+    help="Embed logs which only differ in numbers, IPs, hex, UUIDs or paths once.",
+    show_default=True,
+)
+@click.option(
+    "--embedding-cache",
+    default="256MB",
+    help="Size of embeddings cached across runs, set 0B to disable the cache.",
+    show_default=True,
+)
+@click.option(
+    "--engine",
+    default="exact",
+    type=click.Choice(["exact", "approximate"]),
+    help="Community detection engine, `approximate` compares logs with community leaders only.",
+    show_default=True,
+)
+@click.option(
+    "--embedding-backend",
+    default="torch",
+    type=click.Choice(["torch", "onnx", "onnx-int8"]),
+    help="How logs are embedded, `onnx` runs the model in one ONNX Runtime session, `onnx-int8` with int8 weights.",
+    show_default=True,
+)
+@click.option(
+    "--max-seq-length",
+    default=0,
+    help="Max tokens of each log embedded, set 0 to use the default of the model.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--miner",
+    default="embedding",
+    type=click.Choice(["embedding", "drain"]),
+    help="How unmatched logs are grouped, `drain` mines templates from tokens without loading any model.",
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    help="Number of template extraction requests in flight.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--gpt-cache/--no-gpt-cache",
+    default=True,
+    help="Reuse completions of the same samples across runs.",
+    show_default=True,
+)
+@click.option(
+    "--max-communities",
+    default=3,
+    help="Number of the largest communities extracted in each clustering round, set 0 to extract all.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--regex-budget",
+    default=100.0,
+    help="Microseconds an extracted regex may take to match a log, slower ones are requested again, set 0 to accept all.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--discovery-sample",
+    default=0,
+    help="Number of logs sampled across all files to learn templates from before reading them in full, more leave fewer logs unmatched until late in the run, set 0 to skip.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--infer-rows",
+    default=1024,
+    help="Number of rows of each template to infer column types from, set 0 to store all columns as VARCHAR.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--output",
+    default=None,
+    help="DuckDB file, or directory of Parquet datasets, the logs are written to, in memory if not set.",
+)
+@click.option(
+    "--output-format",
+    default="duckdb",
+    type=click.Choice(["duckdb", "parquet"]),
+    help="Format of the output, `parquet` writes a dataset per template.",
+    show_default=True,
+)
+@click.option(
+    "--partition-by",
+    default="none",
+    type=click.Choice(["none", "source", "hour", "day"]),
+    help="How Parquet datasets are partitioned, `source` by log file names, `hour` and `day` by the first timestamp column.",
+    show_default=True,
+)
+@click.option(
+    "--repl/--no-repl",
+    default=True,
+    help="Open an IPython shell to query the result once logs are collected.",
+    show_default=True,
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    help="Read only logs appended since the last run into the same `--output`.",
+    show_default=True,
+)
+@click.option(
+    "--stats/--no-stats",
+    default=False,
+    help="Print time of each stage of the pipeline, counts and costs of patterns once logs are collected.",
+    show_default=True,
+)
+@click.option(
+    "--metrics",
+    default=None,
+    help="JSON file the measures of `--stats` are written to.",
+)
+@click.option(
+    "--profile",
+    default=None,
+    help="File cProfile stats of the run are written to, see them by `python -m pstats`.",
+)
+def run(
+    file,
+    gpt_base,
+    max_lines,
+    buf_size,
+    max_len,
+    threshold,
+    batch_size,
+    workers,
+    reader,
+    dedup,
+    embedding_cache,
+    engine,
+    embedding_backend,
+    max_seq_length,
+    miner,
+    concurrency,
+    gpt_cache,
+    max_communities,
+    regex_budget,
+    discovery_sample,
+    infer_rows,
+    output,
+    output_format,
+    partition_by,
+    repl,
+    resume,
+    stats,
+    metrics,
+    profile,
+):
     if "OPENAI_API_KEY" not in os.environ:
         logging.error(
             "the tool relies on GPT4, please set env: `OPENAI_API_KEY` as OpenAI API key."
         )
         return
 
-    logging.basicConfig(
-        level="INFO",
-        format="%(message)s",
-        datefmt="[%X]",
-        handlers=[RichHandler()],
-    )
+    configure_logging()
     buf_size = parse_size(buf_size)
+    if output_format == "parquet" and output is None:
+        logging.error("`--output` is required to write Parquet datasets.")
+        return
+    if not repl and output is None:
+        logging.warning("the result is lost without `--output` and a REPL.")
+    if stats or metrics:
+        from bakalog.stats import Stats
+
+        Stats().enable()
+    profiler = None
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
 
     with Memory().current(file):
-        f = Sink(file, max_size=max_len)
-        m = Match(Memory(), f)
-        c = Cluster(f, m, buf_size=buf_size, threshold=threshold)
-        e = extract(
+        checkpoints = None
+        if output:
+            files = Memory().load("checkpoints", {})
+            if not os.path.exists(output):
+                # logs read before are gone with the output
+                files.pop(os.path.abspath(output), None)
+            checkpoints = Checkpoints(
+                files.setdefault(os.path.abspath(output), {}), resume=resume
+            )
+
+        def mine(f, m):
+            if miner == "drain":
+                from bakalog.drain import Drain
+
+                c = Drain(f, m, buf_size=buf_size)
+            else:
+                from bakalog.cluster import Cluster
+
+                c = Cluster(
+                    f,
+                    m,
+                    buf_size=buf_size,
+                    threshold=threshold,
+                    dedup=dedup,
+                    cache_size=parse_size(embedding_cache),
+                    engine=engine,
+                    max_communities=max_communities,
+                    backend=embedding_backend,
+                    max_seq_length=max_seq_length or None,
+                )
+            from bakalog.extract import extract
+
+            return extract(
+                c,
+                m,
+                api_base=gpt_base,
+                model="gpt-4",
+                temperature=0,
+                concurrency=concurrency,
+                cache=gpt_cache,
+                budget=regex_budget * 1e-6,
+            )
+
+        if discovery_sample > 0:
+            from bakalog.discovery import discover
+
+            if miner == "embedding":
+                from bakalog.cluster import warm
+
+                # the model is loaded once for the sample and the full run
+                warm(backend=embedding_backend, max_seq_length=max_seq_length or None)
+            discover(file, discovery_sample, mine, max_size=max_len)
+
+        f = Sink(file, max_size=max_len, reader=reader, checkpoints=checkpoints)
+        if workers > 1:
+            from bakalog.parallel import ParallelMatch
+
+            m = ParallelMatch(Memory(), f, workers=workers)
+        else:
+            m = Match(Memory(), f)
+        e = mine(f, m)
+        result = collect(
+            e,
+            max_lines,
+            db_file=output if output and output_format == "duckdb" else ":default:",
+            batch_size=batch_size,
+            infer_rows=infer_rows,
+            parquet=output if output_format == "parquet" else None,
+            partition_by=None if partition_by == "none" else partition_by,
+            sink=f,
+        )
+        f.checkpoint()
+        if discovery_sample > 0 and miner == "embedding":
+            from bakalog.cluster import release
+
+            release()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+            logging.info(f"profile is written to {profile}.")
+        if stats or metrics:
+            measured = Stats().metrics(m.hits)
+            if metrics:
+                with open(metrics, "w") as out:
+                    json.dump(measured, out, indent=2)
+                logging.info(f"metrics are written to {metrics}.")
+            if stats:
+                print_stats(measured)
+
+        if repl:
+            from IPython import embed
+
+            embed(header="use variable `result` to get the result")
+        result.close()
+        if output:
+            logging.info(f"logs are written to {output}.")
+
+
+def print_stats(measured, patterns=10):
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console(stderr=True)
+    table = Table(
+        "stage", "wall s", "cpu s", "items", "items/s", title="stages", min_width=60
+    )
+    stages = sorted(measured["stages"].items(), key=lambda s: -s[1]["wall"])
+    for name, stage in stages:
+        table.add_row(
+            name,
+            format(stage["wall"], ".3f"),
+            format(stage["cpu"], ".3f"),
+            str(stage["items"]),
+            format(stage["items_per_second"], ".0f") if stage["items"] else "",
+        )
+    console.print(table)
+    console.print(f"elapsed {format(measured['elapsed'], '.3f')}s")
+    for name, value in {**measured["counts"], **measured["peaks"]}.items():
+        prefix = "max " if name in measured["peaks"] else ""
+        console.print(f"{prefix}{name}: {value}")
+
+    table = Table("pattern", "hits", "us/match", title="patterns")
+    for pattern in measured["patterns"][:patterns]:
+        cost = pattern["mean_us"]
+        table.add_row(
+            pattern["pattern"],
+            str(pattern["hits"]),
+            "" if cost is None else format(cost, ".2f"),
+        )
+    cost = measured["unmatched"]["mean_us"]
+    if cost is not None:
+        table.add_row("(unmatched)", "", format(cost, ".2f"))
+    console.print(table)
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+@main.command(
+    help="Follow log files as they are written, files created later included, and write logs matched by learned patterns in micro batches."
+)
+@click.argument("file")
+@click.option(
+    "--output",
+    required=True,
+    help="DuckDB file, or directory of Parquet datasets, the logs are written to.",
+)
+@click.option(
+    "--output-format",
+    default="parquet",
+    type=click.Choice(["duckdb", "parquet"]),
+    help="Format of the output, Parquet datasets can be queried by other processes while following.",
+    show_default=True,
+)
+@click.option(
+    "--partition-by",
+    default="none",
+    type=click.Choice(["none", "source", "hour", "day"]),
+    help="How Parquet datasets are partitioned, `source` by log file names, `hour` and `day` by the first timestamp column.",
+    show_default=True,
+)
+@click.option(
+    "--gpt-base",
+    default=API_BASE,
+    help="OpenAI API base.",
+    show_default=True,
+)
+@click.option(
+    "--buf-size",
+    default="2MB",
+    help="Number of logs to cluster detection.",
+    show_default=True,
+)
+@click.option(
+    "--max-len",
+    default=512,
+    help="Max length of each log, rest of log would be dropped.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--batch-size",
+    default=8192,
+    help="Number of pending rows which triggers a write.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--flush-interval",
+    default=1.0,
+    help="Seconds a matched log waits at most before it is written.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--poll-interval",
+    default=0.2,
+    help="Seconds to wait for new logs once all files are read to the end.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--learn-interval",
+    default=5.0,
+    help="Seconds of unmatched logs mined in each round of learning templates.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--backlog",
+    default=100000,
+    help="Number of unmatched logs waiting to be learned, later ones are dropped.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--miner",
+    default="drain",
+    type=click.Choice(["embedding", "drain"]),
+    help="How unmatched logs are grouped, `drain` mines templates from tokens without loading any model.",
+    show_default=True,
+)
+@click.option(
+    "--threshold",
+    default=0.85,
+    help="Threshold of logs clustering.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--embedding-backend",
+    default="torch",
+    type=click.Choice(["torch", "onnx", "onnx-int8"]),
+    help="How logs are embedded, `onnx` runs the model in one ONNX Runtime session, `onnx-int8` with int8 weights.",
+    show_default=True,
+)
+@click.option(
+    "--max-seq-length",
+    default=0,
+    help="Max tokens of each log embedded, set 0 to use the default of the model.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    help="Number of template extraction requests in flight.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--gpt-cache/--no-gpt-cache",
+    default=True,
+    help="Reuse completions of the same samples across runs.",
+    show_default=True,
+)
+@click.option(
+    "--regex-budget",
+    default=100.0,
+    help="Microseconds an extracted regex may take to match a log, slower ones are requested again, set 0 to accept all.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--infer-rows",
+    default=1024,
+    help="Number of rows of each template to infer column types from, set 0 to store all columns as VARCHAR.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    help="Read only logs appended since the last run into the same `--output`.",
+    show_default=True,
+)
+def follow(
+    file,
+    output,
+    output_format,
+    partition_by,
+    gpt_base,
+    buf_size,
+    max_len,
+    batch_size,
+    flush_interval,
+    poll_interval,
+    learn_interval,
+    backlog,
+    miner,
+    threshold,
+    embedding_backend,
+    max_seq_length,
+    concurrency,
+    gpt_cache,
+    regex_budget,
+    infer_rows,
+    resume,
+):
+    if "OPENAI_API_KEY" not in os.environ:
+        logging.error(
+            "the tool relies on GPT4, please set env: `OPENAI_API_KEY` as OpenAI API key."
+        )
+        return
+
+    configure_logging()
+    buf_size = parse_size(buf_size)
+    signal.signal(signal.SIGTERM, interrupt)
+
+    import duckdb
+
+    from bakalog.extract import extract
+    from bakalog.follow import Follow, Tail
+    from bakalog.writer import ParquetWriter, Writer
+
+    def learn(sink, match):
+        if miner == "drain":
+            from bakalog.drain import Drain
+
+            c = Drain(sink, match, buf_size=buf_size)
+        else:
+            from bakalog.cluster import Cluster
+
+            c = Cluster(
+                sink,
+                match,
+                buf_size=buf_size,
+                threshold=threshold,
+                backend=embedding_backend,
+                max_seq_length=max_seq_length or None,
+            )
+        return extract(
             c,
-            m,
+            match,
             api_base=gpt_base,
             model="gpt-4",
             temperature=0,
+            concurrency=concurrency,
+            cache=gpt_cache,
+            budget=regex_budget * 1e-6,
+        )
+
+    with Memory().current(file):
+        files = Memory().load("checkpoints", {})
+        if not os.path.exists(output):
+            files.pop(os.path.abspath(output), None)
+        checkpoints = Checkpoints(
+            files.setdefault(os.path.abspath(output), {}), resume=resume
+        )
+        if output_format == "parquet":
+            writer = ParquetWriter(
+                output,
+                None if partition_by == "none" else partition_by,
+                batch_size=batch_size,
+                infer_rows=infer_rows,
+            )
+        else:
+            writer = Writer(
+                duckdb.connect(output), batch_size=batch_size, infer_rows=infer_rows
+            )
+        f = Follow(
+            Tail(file, max_size=max_len, checkpoints=checkpoints),
+            Match(Memory(), None),
+            writer,
+            learn,
+            batch_size=batch_size,
+            interval=flush_interval,
+            poll=poll_interval,
+            backlog=backlog,
+            round_time=learn_interval,
+        )
+        try:
+            f.run()
+        except KeyboardInterrupt:
+            pass
+        writer.db.close()
+        logging.info(f"logs are written to {output}.")
+
+
+@main.command(
+    help="Serve ingest and query jobs over a Unix socket, keeping the embedding model, patterns and the output open between jobs."
+)
+@click.option(
+    "--socket",
+    "path",
+    default=SOCKET,
+    help="Unix socket to listen on.",
+    show_default=True,
+)
+@click.option(
+    "--output",
+    default=None,
+    help="DuckDB file, or directory of Parquet datasets, the logs are written to, in memory if not set.",
+)
+@click.option(
+    "--output-format",
+    default="duckdb",
+    type=click.Choice(["duckdb", "parquet"]),
+    help="Format of the output, `parquet` writes a dataset per template.",
+    show_default=True,
+)
+@click.option(
+    "--partition-by",
+    default="none",
+    type=click.Choice(["none", "source", "hour", "day"]),
+    help="How Parquet datasets are partitioned, `source` by log file names, `hour` and `day` by the first timestamp column.",
+    show_default=True,
+)
+@click.option(
+    "--gpt-base",
+    default=API_BASE,
+    help="OpenAI API base.",
+    show_default=True,
+)
+@click.option(
+    "--batch-size",
+    default=8192,
+    help="Number of rows of each template buffered before bulk loading into DuckDB.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--infer-rows",
+    default=1024,
+    help="Number of rows of each template to infer column types from, set 0 to store all columns as VARCHAR.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--warm/--no-warm",
+    default=True,
+    help="Load the embedding model and start its process pool before serving, not needed by jobs of `--miner drain`.",
+    show_default=True,
+)
+@click.option(
+    "--embedding-backend",
+    default="torch",
+    type=click.Choice(["torch", "onnx", "onnx-int8"]),
+    help="How logs are embedded, `onnx` runs the model in one ONNX Runtime session, `onnx-int8` with int8 weights.",
+    show_default=True,
+)
+@click.option(
+    "--max-seq-length",
+    default=0,
+    help="Max tokens of each log embedded, set 0 to use the default of the model.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    help="Number of template extraction requests in flight.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--gpt-cache/--no-gpt-cache",
+    default=True,
+    help="Reuse completions of the same samples across runs.",
+    show_default=True,
+)
+@click.option(
+    "--regex-budget",
+    default=100.0,
+    help="Microseconds an extracted regex may take to match a log, slower ones are requested again, set 0 to accept all.",
+    type=float,
+    show_default=True,
+)
+def serve(
+    path,
+    output,
+    output_format,
+    partition_by,
+    gpt_base,
+    batch_size,
+    infer_rows,
+    warm,
+    embedding_backend,
+    max_seq_length,
+    concurrency,
+    gpt_cache,
+    regex_budget,
+):
+    if "OPENAI_API_KEY" not in os.environ:
+        logging.error(
+            "the tool relies on GPT4, please set env: `OPENAI_API_KEY` as OpenAI API key."
+        )
+        return
+
+    configure_logging()
+    if output_format == "parquet" and output is None:
+        logging.error("`--output` is required to write Parquet datasets.")
+        return
+    signal.signal(signal.SIGTERM, interrupt)
+
+    import duckdb
+
+    from bakalog.serve import Server
+    from bakalog.writer import ParquetWriter, Writer
+
+    fresh = output is not None and not os.path.exists(output)
+    if output_format == "parquet":
+        writer = ParquetWriter(
+            output,
+            None if partition_by == "none" else partition_by,
+            batch_size=batch_size,
+            infer_rows=infer_rows,
         )
-        result = collect(e, max_lines)
+    else:
+        writer = Writer(
+            duckdb.connect(output or ":memory:"),
+            batch_size=batch_size,
+            infer_rows=infer_rows,
+        )
+    server = Server(
+        writer,
+        output,
+        path=path,
+        warm=warm,
+        fresh=fresh,
+        backend=embedding_backend,
+        max_seq_length=max_seq_length or None,
+        api_base=gpt_base,
+        model="gpt-4",
+        temperature=0,
+        concurrency=concurrency,
+        cache=gpt_cache,
+        budget=regex_budget * 1e-6,
+    )
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if warm:
+            from bakalog.cluster import release
+
+            release()
+        writer.db.close()
+
+
+def request(f, *args, **kwargs):
+    try:
+        return f(*args, **kwargs)
+    except (FileNotFoundError, ConnectionRefusedError):
+        raise click.ClickException(
+            "bakalog doesn't serve, start it by `bakalog serve`."
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+
+@main.command(help="Collect logs into the output of `bakalog serve`.")
+@click.argument("file")
+@click.option(
+    "--socket",
+    "path",
+    default=SOCKET,
+    help="Unix socket `bakalog serve` listens on.",
+    show_default=True,
+)
+@click.option(
+    "--max-lines",
+    default=4096,
+    help="Max log lines would be parsed, set 0 to parese all logs.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--buf-size",
+    default="2MB",
+    help="Number of logs to cluster detection.",
+    show_default=True,
+)
+@click.option(
+    "--max-len",
+    default=512,
+    help="Max length of each log, rest of log would be dropped.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--threshold",
+    default=0.85,
+    help="Threshold of logs clustering.",
+    type=float,
+    show_default=True,
+)
+@click.option(
+    "--workers",
+    default=1,
+    help="Number of processes matching logs with learned patterns.",
+    type=int,
+    show_default=True,
+)
+@click.option(
+    "--miner",
+    default="embedding",
+    type=click.Choice(["embedding", "drain"]),
+    help="How unmatched logs are grouped, `drain` mines templates from tokens without loading any model.",
+    show_default=True,
+)
+@click.option(
+    "--resume/--no-resume",
+    default=True,
+    help="Read only logs appended since the last job into the same output.",
+    show_default=True,
+)
+def ingest(file, path, max_lines, buf_size, max_len, threshold, workers, miner, resume):
+    response = request(
+        client.ingest,
+        file,
+        path,
+        max_lines=max_lines,
+        buf_size=buf_size,
+        max_len=max_len,
+        threshold=threshold,
+        workers=workers,
+        miner=miner,
+        resume=resume,
+    )
+    click.echo(
+        f"collected {response['rows']} logs in {format(response['seconds'], '.2f')}s."
+    )
+
+
+@main.command(help="Query the output of `bakalog serve` with SQL.")
+@click.argument("sql")
+@click.option(
+    "--socket",
+    "path",
+    default=SOCKET,
+    help="Unix socket `bakalog serve` listens on.",
+    show_default=True,
+)
+def query(sql, path):
+    from rich.console import Console
+    from rich.table import Table
 
-        embed(header="use variable `result` to get the result")
+    response = request(client.query, sql, path)
+    table = Table(*response["columns"])
+    for row in response["rows"]:
+        table.add_row(*[str(value) for value in row])
+    Console().print(table)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import contextlib
+import fcntl
+import hashlib
+import os
+from typing import List, Tuple
+
+import numpy
+
+from .util import Memory
+
+
+class EmbeddingCache:
+    """
+    Embeddings kept across runs in a memory-mapped float16 matrix under `Memory.PATH`. Each slot of the
+    matrix is keyed by a 64-bit hash of the embedded text, the least recently used slots are evicted
+    once the matrix is full. Caches of different models or dimensions live in different files.
+
+    Processes share a cache under a file lock, the index is reloaded once another process replaced
+    it, and slots are written with the index before the lock is released.
+    """
+
+    def __init__(self, model: str, dim: int, capacity: int, path: str = Memory.PATH):
+        name = hashlib.sha1(f"{model}:{dim}".encode()).hexdigest()[:16]
+        self.path = os.path.join(path, f"embeddings-{name}")
+        self.index_path = f"{self.path}.index.npz"
+        self.lock_path = f"{self.path}.lock"
+        self.capacity = capacity
+        # the index file last loaded or saved
+        self.loaded = None
+        self.hits = 0
+        self.misses = 0
+
+        size = capacity * dim * numpy.dtype(numpy.float16).itemsize
+        with self._locked():
+            fresh = not os.path.exists(self.path) or os.path.getsize(self.path) != size
+            self.matrix = numpy.memmap(
+                self.path,
+                dtype=numpy.float16,
+                mode="w+" if fresh else "r+",
+                shape=(capacity, dim),
+            )
+            if fresh and os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            self._reload()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        stat = self._stat()
+        if stat is not None and stat == self.loaded:
+            return
+
+        if stat is None:
+            self.keys = numpy.zeros(self.capacity, dtype=numpy.uint64)
+            # 0 marks an empty slot
+            self.ticks = numpy.zeros(self.capacity, dtype=numpy.int64)
+        else:
+            with numpy.load(self.index_path) as index:
+                self.keys, self.ticks = index["keys"], index["ticks"]
+        self.slots = {
+            int(key): slot
+            for slot, key in enumerate(self.keys.tolist())
+            if self.ticks[slot] > 0
+        }
+        self.tick = int(self.ticks.max(initial=0))
+        self.loaded = stat
+
+    @staticmethod
+    def key(text: str) -> int:
+        digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def get(self, keys: List[int]) -> Tuple[List[int], numpy.ndarray]:
+        """
+        Returns offsets of missed keys, and embeddings of all keys where missed rows are zeros.
+        """
+        with self._locked():
+            self._reload()
+            missing, vectors = self._get(keys)
+            self._save()
+        return missing, vectors
+
+    def _get(self, keys: List[int]) -> Tuple[List[int], numpy.ndarray]:
+        self.tick += 1
+        vectors = numpy.zeros((len(keys), self.matrix.shape[1]), dtype=numpy.float32)
+        missing, found, slots = [], [], []
+        for offset, key in enumerate(keys):
+            slot = self.slots.get(key)
+            if slot is None:
+                missing.append(offset)
+            else:
+                found.append(offset)
+                slots.append(slot)
+
+        if len(slots) > 0:
+            vectors[found] = self.matrix[slots]
+            self.ticks[slots] = self.tick
+
+        self.hits += len(found)
+        self.misses += len(missing)
+        return missing, vectors
+
+    def put(self, keys: List[int], vectors: numpy.ndarray):
+        with self._locked():
+            self._reload()
+            self._put(keys, vectors)
+            self.matrix.flush()
+            self._save()
+
+    def _put(self, keys: List[int], vectors: numpy.ndarray):
+        offsets = {}
+        for offset, key in enumerate(keys):
+            if key not in self.slots:
+                offsets[key] = offset
+        keys = list(offsets)[-self.capacity :]
+        vectors = vectors[list(offsets.values())][-self.capacity :]
+
+        slots = self._evict(len(keys))
+        for slot, key in zip(slots.tolist(), keys):
+            self.slots[key] = slot
+        self.keys[slots] = keys
+        self.ticks[slots] = self.tick
+        self.matrix[slots] = vectors
+
+    def _evict(self, n: int) -> numpy.ndarray:
+        slots = numpy.argpartition(self.ticks, n - 1)[:n] if n > 0 else []
+        for slot in slots:
+            key = int(self.keys[slot])
+            if self.ticks[slot] > 0 and self.slots.get(key) == slot:
+                del self.slots[key]
+        self.ticks[slots] = 0
+        return numpy.asarray(slots, dtype=numpy.int64)
+
+    def flush(self):
+        # slots are written by `put` already
+        self.matrix.flush()
+
+    def _save(self):
+        tmp = f"{self.index_path}.{os.getpid()}.tmp.npz"
+        numpy.savez(tmp, keys=self.keys, ticks=self.ticks)
+        os.replace(tmp, self.index_path)
+        self.loaded = self._stat()
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import mmap
+import os
+from typing import Dict, Optional, Tuple
+
+from .compress import decompress
+
+BLOCK_SIZE = 4 * 1024 * 1024
+# bytes of the head of a file which identify it across runs
+HEAD = 4096
+
+
+def fingerprint(file: str, size: int) -> str:
+    with open(file, "rb") as f:
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+
+def tail(file: str, start: int, size: int) -> int:
+    """
+    Returns the offset right after the last newline of `file[start:size]`, a partial line might
+    still be written.
+    """
+    with open(file, "rb") as f:
+        end = size
+        while end > start:
+            begin = max(end - 64 * 1024, start)
+            f.seek(begin)
+            found = f.read(end - begin).rfind(b"\n")
+            if found >= 0:
+                return begin + found + 1
+            end = begin
+    return start
+
+
+def skip(file: str, start: int) -> int:
+    """
+    Returns `start`, or the offset after the line it falls in unless it follows a newline, the
+    start of the line was read as a final partial line already.
+    """
+    if start == 0:
+        return start
+    with open(file, "rb") as f:
+        f.seek(start - 1)
+        if f.read(1) != b"\n":
+            f.readline()
+        return f.tell()
+
+
+def locate(file: str, codec: Optional[str], start: int, lines: int) -> int:
+    """
+    Returns the offset right after `lines` lines from `start`, offsets of compressed files are in
+    decompressed bytes.
+    """
+    if lines == 0:
+        return start
+
+    if codec is None:
+        with open(file, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return count(buf, start, len(buf), lines)
+
+    offset = 0
+    with decompress(file, codec) as f:
+        while True:
+            block = f.read(BLOCK_SIZE)
+            if not block:
+                return offset
+            begin = min(max(start - offset, 0), len(block))
+            found = block.count(b"\n", begin)
+            if found >= lines:
+                return offset + count(block, begin, len(block), lines)
+            lines -= found
+            offset += len(block)
+
+
+def count(buf, start: int, end: int, lines: int) -> int:
+    # count newlines in blocks, then find the last one line by line
+    while start < end:
+        stop = min(start + BLOCK_SIZE, end)
+        found = buf[start:stop].count(b"\n")
+        if found >= lines:
+            break
+        lines -= found
+        start = stop
+    for _ in range(lines):
+        start = buf.find(b"\n", start, end) + 1 or end
+    return start
+
+
+class Checkpoints:
+    """
+    Offsets of each log file ingested into one output, with the inode, size, mtime and a fingerprint
+    of the head of the file. A file is resumed from its offset unless it was truncated or replaced,
+    a file renamed by rotation is found by its inode.
+    """
+
+    def __init__(self, files: Dict[str, dict], resume: bool = True):
+        self.files = files
+        self.resume = resume
+        # offsets are committed once logs read up to them are written
+        self.pending: Dict[str, dict] = {}
+
+    def start(self, file: str) -> Tuple[int, int, bool]:
+        """
+        Returns the offset and the line number to resume from, and whether the file is unchanged.
+        """
+        stat = os.stat(file)
+        checkpoint = self.files.get(file)
+        if checkpoint is None or checkpoint["inode"] != stat.st_ino:
+            # renamed by rotation, the checkpoint moves to the new name
+            checkpoint = next(
+                (c for c in self.files.values() if c["inode"] == stat.st_ino), None
+            )
+            if checkpoint is not None:
+                self.pending[file] = checkpoint
+        if not self.resume or checkpoint is None:
+            return 0, 0, False
+
+        same = (checkpoint["size"], checkpoint["mtime"]) == (
+            stat.st_size,
+            stat.st_mtime,
+        )
+        if same and checkpoint["complete"]:
+            return checkpoint["offset"], checkpoint["lineno"], True
+
+        truncated = stat.st_size < checkpoint["size"]
+        if truncated or checkpoint["head"] != fingerprint(
+            file, checkpoint["head_size"]
+        ):
+            logging.warning(f"{file} is truncated or replaced, read it from the start.")
+            return 0, 0, False
+
+        logging.info(f"resume {file} from line {checkpoint['lineno'] + 1}.")
+        return checkpoint["offset"], checkpoint["lineno"], False
+
+    def settled(self, file: str) -> bool:
+        """
+        Whether `file` has the size and mtime it had when it was last read, so a partial last line
+        isn't written anymore.
+        """
+        stat = os.stat(file)
+        checkpoint = self.pending.get(file, self.files.get(file))
+        return (
+            self.resume
+            and checkpoint is not None
+            and checkpoint["inode"] == stat.st_ino
+            and (checkpoint["size"], checkpoint["mtime"])
+            == (stat.st_size, stat.st_mtime)
+        )
+
+    def done(self, file: str, offset: int, lineno: int, complete: bool):
+        stat = os.stat(file)
+        head_size = min(HEAD, stat.st_size)
+        self.pending[file] = {
+            "inode": stat.st_ino,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "offset": offset,
+            "lineno": lineno,
+            # read to the end
+            "complete": complete,
+            "head": fingerprint(file, head_size),
+            "head_size": head_size,
+        }
+
+    def commit(self):
+        for checkpoint in self.pending.values():
+            # the file which had the inode before is renamed
+            for name, c in list(self.files.items()):
+                if c["inode"] == checkpoint["inode"]:
+                    del self.files[name]
+        self.files.update(self.pending)
+        self.pending = {}
@@ -0,0 +1,39 @@
+"""
+Client of `bakalog serve`, it only needs the standard library so a job starts in milliseconds.
+Requests and responses are JSON lines over a Unix socket.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+from typing import Any, Dict
+
+SOCKET = f"{os.environ['HOME']}/.bakalog/serve.sock"
+
+
+def request(command: str, path: str = SOCKET, **arguments) -> Dict[str, Any]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        with s.makefile("rwb") as f:
+            f.write(json.dumps({"command": command, **arguments}).encode() + b"\n")
+            f.flush()
+            response = json.loads(f.readline())
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response
+
+
+def ingest(file: str, path: str = SOCKET, **options) -> Dict[str, Any]:
+    """
+    Collects logs of `file` into the output of the server, returns the number of rows and the
+    seconds spent.
+    """
+    return request("ingest", path, file=os.path.abspath(file), options=options)
+
+
+def query(sql: str, path: str = SOCKET) -> Dict[str, Any]:
+    """
+    Returns the `columns` and `rows` of a query of the output of the server.
+    """
+    return request("query", path, sql=sql)
@@ -3,16 +3,50 @@ from __future__ import annotations
 import os
 import contextlib
 import logging
-from typing import Generator, List
+from typing import TYPE_CHECKING, Dict, Generator, List, Tuple
 
 import numpy
-import torch
 
-from . import Log, Match, Sink
+from . import Batch, Log, Match, Sink
+from .stats import Stats
+
+if TYPE_CHECKING:
+    import torch
+
+
+_path = os.path.dirname(__file__)
+MODEL = os.path.join(_path, "../all-MiniLM-L6-v2")
+
+# models of each backend and their process pools kept warm across jobs by `bakalog serve`
+resident: Dict[Tuple[str, str], Tuple[object, dict]] = {}
+
+
+def warm(model: str = MODEL, backend: str = "torch", max_seq_length=None):
+    """
+    Loads the model and starts its process pool once, clusters of the same model and backend use
+    them until `release`.
+    """
+    if (model, backend) not in resident:
+        from .embedding import load
+
+        embedder = load(model, backend, max_seq_length)
+        resident[model, backend] = (embedder, embedder.start_multi_process_pool())
+    return resident[model, backend][0]
+
+
+def release():
+    while resident:
+        _, (model, pool) = resident.popitem()
+        model.stop_multi_process_pool(pool)
 
 
 @contextlib.contextmanager
 def pool(model):
+    for embedder, warm_pool in resident.values():
+        if embedder is model:
+            yield warm_pool
+            return
+
     pool = model.start_multi_process_pool()
     try:
         yield pool
@@ -45,108 +79,242 @@ class Community:
 
 
 def sample(community: torch.Tensor) -> List[int]:
-    from sentence_transformers.util import cos_sim
-
-    sims = cos_sim(community, community)
-
-    min = (0, 1)
-    for offset, sim in enumerate(sims):
-        mean = sim.mean()
-        if mean < min[1]:
-            min = (offset, mean)
-
-    sort = sorted(
-        [(offset, sim) for offset, sim in enumerate(sims[min[0]].numpy())],
-        key=lambda i: i[1],
-    )
-
-    samples = [community[min[0]], community[sort[0][0]]]
-
-    sims = cos_sim(community, torch.from_numpy(numpy.array(samples)))
-
-    min1 = (0, 1)
-    for offset, sim in enumerate(sims):
-        mean = sim.mean()
-        if mean < min1[1]:
-            min1 = (offset, mean)
+    """
+    Picks three diverse members: the least similar to the others on average, the least similar to
+    it, and the least similar to both. A mean similarity is the dot product with the centroid of the
+    normalized embeddings, so memory is linear in the size of the community.
+    """
+    import torch
 
-    return [min[0], sort[0][0], min1[0]]
+    normalized = torch.nn.functional.normalize(community.float(), dim=1)
+    first = int(torch.argmin(normalized @ normalized.mean(dim=0)))
+    second = int(torch.argmin(normalized @ normalized[first]))
+    third = int(torch.argmin(normalized @ (normalized[first] + normalized[second])))
+    return [first, second, third]
 
 
-_path = os.path.dirname(__file__)
+class Cluster:
+    """
+    Groups unmatched logs by communities of their embeddings. The model, its process pool and torch
+    are only loaded once a buffer of logs is embedded, runs whose logs are all matched by learned
+    patterns don't pay for them. `backend` embeds with torch, or with ONNX Runtime, see
+    `embedding.load`, logs are truncated to `max_seq_length` tokens, the default of the model if not
+    set.
 
+    Logs of a round wait while templates of its samples are extracted, and matching goes on. They
+    are recycled once the next buffer is full, or at the end of the logs.
+    """
 
-class Cluster:
     def __init__(
         self,
         sink: Sink,
         match: Match,
-        model=os.path.join(_path, "../all-MiniLM-L6-v2"),
+        model=MODEL,
         buf_size=8 * 1024 * 1024,
         threshold=0.7,
         min_community_size=3,
+        dedup=True,
+        cache_size=256 * 1024 * 1024,
+        engine="exact",
+        max_communities=3,
+        backend="torch",
+        max_seq_length=None,
     ):
-        from sentence_transformers import SentenceTransformer as Embedder
-
         self.buf_size = buf_size
         self.threshold = threshold
         self.min_community_size = min_community_size
+        self.dedup = dedup
+        self.engine = engine
+        self.max_communities = max_communities
         self.sink = sink
         self.match = match
-        self.model = Embedder(model)
+        self.path = model
+        self.backend = backend
+        self.max_seq_length = max_seq_length
+        self.model = None
+        self.cache_size = cache_size
+        self.cache = None
         self.buffer = []
+        self.origins = []
+        self.generations = []
         self.size = 0
+        # logs, origins and generations of the last round until its patterns are learned
+        self.waiting = None
+        self.rounds = 0
+        self.embedded = 0
+        self.recycled = 0
+        sink.holders.append(self)
+
+    def held(self):
+        if self.waiting is None:
+            return self.origins
+        return self.origins + self.waiting[1]
 
     def __iter__(self):
-        import torch
-        from .util import community_detection
+        try:
+            yield from self._rounds()
+        finally:
+            logging.info(
+                f"{self.rounds} clustering rounds, {self.embedded} logs embedded, "
+                f"{self.recycled} of them recycled to be embedded again."
+            )
+
+    def _load(self):
+        if (self.path, self.backend) in resident:
+            self.model = resident[self.path, self.backend][0]
+        else:
+            from .embedding import load
+
+            self.model = load(self.path, self.backend, self.max_seq_length)
+
+        if self.cache_size > 0:
+            from .cache import EmbeddingCache
+
+            # int8 weights and shorter sequences change embeddings, fp32 ONNX doesn't
+            name = os.path.basename(os.path.normpath(self.path))
+            if self.backend == "onnx-int8":
+                name += "-int8"
+            if self.max_seq_length:
+                name += f"-{self.max_seq_length}"
+            dim = self.model.get_sentence_embedding_dimension()
+            self.cache = EmbeddingCache(
+                name,
+                dim,
+                max(self.cache_size // (dim * 2), 1),
+            )
 
-        with pool(self.model) as p:
-            for line in self.match:
-                if isinstance(line, Log):
+    def _rounds(self):
+        with contextlib.ExitStack() as stack:
+            p = None
+            for line in Stats().timed("match", self.match):
+                if isinstance(line, (Log, Batch)):
                     yield line
                     continue
 
                 if line is not None:
                     self.buffer.append(line)
+                    self.origins.append(self.match.origin)
+                    self.generations.append(self.match.generation)
                     self.size += len(line)
 
                 if self.size < self.buf_size and line is not None:
                     continue
 
+                if self.waiting is not None:
+                    # wait for patterns of the last round before recycling
+                    yield None
+                    yield from self._recycle()
+                    yield from self._rematch()
+
                 if self.size == 0:
                     continue
 
-                logging.info(
-                    f"embedding {format(self.size / 1024, '.2f')}KB / {len(self.buffer)} logs, it might take a while."
-                )
-                embeddings = torch.from_numpy(
-                    self.model.encode_multi_process(self.buffer, p)
-                )
-
-                if len(embeddings) < 3:
+                if len(self.buffer) < 3:
                     continue
 
-                logging.info("analyze log communities, it might take a while.")
-                clusters = community_detection(
-                    embeddings,
-                    min_community_size=self.min_community_size,
-                    threshold=self.threshold,
-                )
+                if p is None:
+                    self._load()
+                    p = stack.enter_context(pool(self.model))
+                Stats().peak("miner buffer", len(self.buffer))
+                embeddings, clusters = self._detect(p)
+                self.rounds += 1
+                self.embedded += len(self.buffer)
                 logging.info(f"get {len(clusters)} log communities.")
 
                 if len(clusters) > 0:
                     yield from self._sample(clusters, embeddings)
-                    self._recycle()
+                    self.waiting = (self.buffer, self.origins, self.generations)
+                    self.buffer, self.origins, self.generations = [], [], []
+                    self.size = 0
+                    if line is None:
+                        # the sink only goes on with logs recycled before it resumes
+                        yield None
+                        yield from self._recycle()
                 else:
                     logging.warning(
                         f"no cluster is detected, maybe you should decrease the threshold."
                     )
+            # logs left at the end of the sink aren't clustered, they are dropped
+            self.buffer, self.origins, self.generations = [], [], []
+            self.size = 0
+
+    def _detect(self, p):
+        import torch
+
+        from .util import (
+            approximate_community_detection,
+            canonicalize,
+            community_detection,
+        )
+
+        # lines which only differ in variables are embedded once
+        if self.dedup:
+            groups = {}
+            for offset, line in enumerate(self.buffer):
+                groups.setdefault(canonicalize(line), []).append(offset)
+            keys, members = list(groups.keys()), list(groups.values())
+        else:
+            keys = self.buffer
+            members = [[offset] for offset in range(len(self.buffer))]
+
+        logging.info(
+            f"embedding {format(self.size / 1024, '.2f')}KB / {len(self.buffer)} logs "
+            f"({len(members)} unique), it might take a while."
+        )
+        with Stats().stage("embed"):
+            embeddings = torch.from_numpy(
+                self._encode([self.buffer[offsets[0]] for offsets in members], keys, p)
+            )
+
+        logging.info("analyze log communities, it might take a while.")
+        detect = {
+            "exact": community_detection,
+            "approximate": approximate_community_detection,
+        }[self.engine]
+        with Stats().stage("community detection"):
+            clusters = detect(
+                embeddings,
+                min_community_size=1 if self.dedup else self.min_community_size,
+                threshold=self.threshold,
+            )
+        clusters = [
+            [offset for id in cluster for offset in members[id]] for cluster in clusters
+        ]
+        clusters = sorted(
+            [c for c in clusters if len(c) >= self.min_community_size],
+            key=lambda c: len(c),
+            reverse=True,
+        )
+
+        reps = torch.empty(len(self.buffer), dtype=torch.long)
+        for id, offsets in enumerate(members):
+            reps[offsets] = id
+        return embeddings[reps], clusters
+
+    def _encode(self, lines: List[str], keys: List[str], p) -> numpy.ndarray:
+        if self.cache is None:
+            return self.model.encode_multi_process(lines, p)
+
+        keys = [self.cache.key(key) for key in keys]
+        missing, embeddings = self.cache.get(keys)
+        logging.info(f"{len(lines) - len(missing)} embeddings are cached.")
+        if len(missing) > 0:
+            encoded = self.model.encode_multi_process([lines[i] for i in missing], p)
+            embeddings[missing] = encoded
+            self.cache.put([keys[i] for i in missing], encoded)
+            self.cache.flush()
+        return embeddings
 
     def _sample(self, clusters, embeddings):
-        for cluster, _ in zip(clusters, range(0, 3)):
-            vecs = [embeddings[i] for i in cluster]
-            ids = sample(torch.from_numpy(numpy.array(vecs)))
+        # 0 extracts every community of the round
+        for cluster in clusters[: self.max_communities or None]:
+            ids = sample(embeddings[cluster])
+
+            # duplicated lines have the same embedding, pick other members instead
+            ids = list(dict.fromkeys(ids))
+            for id in (len(cluster) // 2, len(cluster) - 1):
+                if len(ids) < 3 and id not in ids:
+                    ids.append(id)
             samples = Community.from_list(
                 [self.buffer[cluster[id]] for id in ids],
                 [embeddings[cluster[id]] for id in ids],
@@ -156,7 +324,31 @@ class Cluster:
             logging.info(f"yield samples {samples.texts}")
             yield samples.texts
 
+    def _unmatched(self, lines, origins, generations):
+        # matches lines against patterns learned since they were matched
+        rest, rest_origins = [], []
+        for line, origin, generation in zip(lines, origins, generations):
+            log = self.match.match(line, origin, start=generation)
+            if log is None:
+                rest.append(line)
+                rest_origins.append(origin)
+            else:
+                yield log
+        return rest, rest_origins
+
+    def _rematch(self):
+        self.buffer, self.origins = yield from self._unmatched(
+            self.buffer, self.origins, self.generations
+        )
+        self.generations = [len(self.match.patterns)] * len(self.buffer)
+        self.size = sum(len(line) for line in self.buffer)
+
     def _recycle(self):
-        send, self.buffer = self.buffer, []
-        self.size = 0
-        self.sink.send(send)
+        # only lines which patterns of this round don't match need another round
+        send, origins = yield from self._unmatched(*self.waiting)
+        self.waiting = None
+        self.recycled += len(send)
+        Stats().count("recycled", len(send))
+        logging.info(f"recycle {len(send)} unmatched logs.")
+        generation = len(self.match.patterns)
+        self.sink.send(send, origins, [generation] * len(send))
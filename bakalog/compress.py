@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import bz2
+import gzip
+import lzma
+from typing import BinaryIO, Optional
+
+MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"\xfd7zXZ\x00": "xz",
+}
+
+
+def compression(file: str) -> Optional[str]:
+    with open(file, "rb") as f:
+        head = f.read(6)
+    for magic, format in MAGIC.items():
+        if head.startswith(magic):
+            return format
+    return None
+
+
+def decompress(file: str, format: str) -> BinaryIO:
+    if format == "gzip":
+        return gzip.open(file, "rb")
+    if format == "bz2":
+        return bz2.open(file, "rb")
+    if format == "xz":
+        return lzma.open(file, "rb")
+    if format == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                f"{file} is compressed by zstd, please install `zstandard` to read it."
+            )
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(file, "rb"), closefd=True
+        )
+    raise ValueError(f"unknown compression format: {format}")
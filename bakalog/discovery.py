@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import logging
+import os
+import random
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+from . import BLOCK_SIZE, Match, Sink, split
+from .compress import compression, decompress
+from .util import Batch, Log, Memory
+
+
+def quotas(sizes: List[int], size: int) -> List[int]:
+    """
+    Splits `size` lines across files in proportion to their bytes, every file gets at least one.
+    """
+    total = max(sum(sizes), 1)
+    return [max(1, round(size * s / total)) for s in sizes]
+
+
+class Sample(Sink):
+    """
+    About `size` lines sampled across all files matching `path`, stratified by file in proportion to
+    their sizes. Lines of a plain file start after random byte offsets, so only the sampled lines are
+    read. Compressed files can't be seeked, their lines are reservoir-sampled from the first block.
+    Sampled lines have no line number.
+    """
+
+    def __init__(
+        self, path: str, size: int, max_size: int = 512, seed: Optional[int] = None
+    ):
+        super().__init__(path, max_size=max_size)
+        self.size = size
+        self.random = random.Random(seed)
+
+    def __iter__(self):
+        def f():
+            for line, source in self.sample():
+                self.source, self.lineno = source, None
+                yield line
+
+        yield from self.drain(f())
+
+    def sample(self) -> List[Tuple[str, str]]:
+        files = [f for f in self.files() if os.path.getsize(f) > 0]
+        if len(files) > self.size:
+            files = self.random.sample(files, self.size)
+        sampled = []
+        for file, quota in zip(
+            files, quotas([os.path.getsize(f) for f in files], self.size)
+        ):
+            codec = compression(file)
+            if codec is None:
+                lines = self._seek(file, quota)
+            else:
+                lines = self._reservoir(file, codec, quota)
+            sampled += [(line, file) for line in lines]
+        logging.info(f"sample {len(sampled)} logs of {len(files)} files.")
+        return sampled
+
+    def _seek(self, file: str, quota: int) -> List[str]:
+        size = os.path.getsize(file)
+        offsets = sorted(self.random.randrange(size) for _ in range(quota))
+        lines, start = [], -1
+        with open(file, "rb") as f:
+            for offset in offsets:
+                if offset < start:
+                    # the line after this offset is sampled already
+                    continue
+                f.seek(offset)
+                if offset > 0:
+                    # the rest of the line the offset falls in
+                    f.readline()
+                start = f.tell()
+                line = f.readline()
+                lines += split(line, 0, len(line), self.max_size)
+        return lines
+
+    def _reservoir(self, file: str, codec: str, quota: int) -> List[str]:
+        lines, seen = [], 0
+        with decompress(file, codec) as f:
+            block = f.read(BLOCK_SIZE)
+            # the last line of the block may be partial
+            cut = block.rfind(b"\n") + 1 or len(block)
+            for line in split(block, 0, cut, self.max_size):
+                seen += 1
+                if len(lines) < quota:
+                    lines.append(line)
+                else:
+                    i = self.random.randrange(seen)
+                    if i < quota:
+                        lines[i] = line
+        return lines
+
+
+def discover(
+    path: str,
+    size: int,
+    mine: Callable[[Sink, Match], Iterable[Union[Log, Batch]]],
+    max_size: int = 512,
+    seed: Optional[int] = None,
+) -> int:
+    """
+    Learns patterns from lines sampled across all files with `mine`, before they are read in full,
+    so templates which only appear in later files don't take extra rounds of clustering deep into
+    the run. Logs of the sample are read again by the full run, those matched here are dropped.
+    Returns the number of patterns learned.
+    """
+    sink = Sample(path, size, max_size=max_size, seed=seed)
+    match = Match(Memory(), sink)
+    before = len(match.patterns)
+    for _ in mine(sink, match):
+        pass
+    logging.info(
+        f"discover {len(match.patterns) - before} patterns from the sample of {path}."
+    )
+    return len(match.patterns) - before
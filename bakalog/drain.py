@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from . import Batch, Log, Match, Sink
+from .stats import Stats
+
+WILDCARD = "<*>"
+
+
+class Template:
+    def __init__(self, key: int, tokens: List[str], line: str, leaf: List[int]):
+        self.key = key
+        self.leaf = leaf
+        self.tokens = tokens
+        self.samples = [line]
+        self.size = 1
+        self.emitted = False
+
+    def similarity(self, tokens: List[str]) -> float:
+        same = sum(1 for a, b in zip(self.tokens, tokens) if a == b)
+        return same / len(tokens)
+
+    def update(self, tokens: List[str], line: str, samples: int):
+        if any(a != b for a, b in zip(self.tokens, tokens)):
+            # only lines which reveal another variable are worth as samples
+            if len(self.samples) < samples and line not in self.samples:
+                self.samples.append(line)
+            self.tokens = [
+                a if a == b else WILDCARD for a, b in zip(self.tokens, tokens)
+            ]
+        self.size += 1
+
+
+class Drain:
+    """
+    Token-based online template miner as an alternative to `Cluster`, it doesn't need any model.
+    Lines are tokenized and routed through a fixed-depth tree (token count, then the first tokens),
+    each leaf holds templates which lines are merged into when enough of their tokens are the same.
+    A template is yielded as samples to extract once it has `min_community_size` lines. Templates are
+    evicted in LRU order over `max_templates` to keep memory bounded.
+    """
+
+    def __init__(
+        self,
+        sink: Sink,
+        match: Match,
+        buf_size=8 * 1024 * 1024,
+        depth=4,
+        similarity=0.4,
+        max_children=100,
+        max_templates=10000,
+        min_community_size=3,
+        samples=3,
+    ):
+        self.sink = sink
+        self.match = match
+        self.buf_size = buf_size
+        self.depth = depth
+        self.similarity = similarity
+        self.max_children = max_children
+        self.max_templates = max_templates
+        self.min_community_size = min_community_size
+        self.samples = samples
+        self.tree: Dict = {}
+        self.templates: OrderedDict[int, Template] = OrderedDict()
+        self.key = 0
+        self.buffer = []
+        self.origins = []
+        self.generations = []
+        self.size = 0
+        self.emitted = 0
+        sink.holders.append(self)
+
+    def held(self):
+        return self.origins
+
+    def __iter__(self):
+        for line in Stats().timed("match", self.match):
+            if isinstance(line, (Log, Batch)):
+                yield line
+                continue
+
+            if line is not None:
+                self.buffer.append(line)
+                self.origins.append(self.match.origin)
+                self.generations.append(self.match.generation)
+                self.size += len(line)
+
+                template = self._add(line)
+                if template.size >= self.min_community_size and not template.emitted:
+                    template.emitted = True
+                    self.emitted += 1
+                    logging.info(f"yield samples {template.samples}")
+                    # the template keeps updating its samples while they are extracted
+                    yield list(template.samples)
+
+            if self.size < self.buf_size and line is not None:
+                continue
+
+            if self.emitted > 0:
+                # wait for patterns of the samples before recycling
+                yield None
+                self._recycle()
+            elif len(self.buffer) > 0:
+                logging.warning(
+                    f"no template is detected in {len(self.buffer)} logs, drop them."
+                )
+                self.buffer, self.origins, self.generations = [], [], []
+                self.size = 0
+
+    def _add(self, line: str) -> Template:
+        tokens = line.split() or [""]
+        leaf = self._leaf(tokens)
+
+        best: Optional[Template] = None
+        similarity = -1.0
+        for key in leaf:
+            template = self.templates[key]
+            s = template.similarity(tokens)
+            if s > similarity:
+                best, similarity = template, s
+
+        if best is not None and similarity >= self.similarity:
+            best.update(tokens, line, self.samples)
+            self.templates.move_to_end(best.key)
+            return best
+
+        self.key += 1
+        template = Template(self.key, tokens, line, leaf)
+        self.templates[template.key] = template
+        leaf.append(template.key)
+        if len(self.templates) > self.max_templates:
+            self._evict()
+        return template
+
+    def _leaf(self, tokens: List[str]) -> List[int]:
+        node = self.tree.setdefault(len(tokens), {})
+        for token in tokens[: self.depth - 2]:
+            if any(char.isdigit() for char in token):
+                token = WILDCARD
+            if token not in node:
+                if len(node) >= self.max_children:
+                    token = WILDCARD
+                node = node.setdefault(token, {})
+            else:
+                node = node[token]
+        return node.setdefault(None, [])
+
+    def _evict(self):
+        key, template = self.templates.popitem(last=False)
+        template.leaf.remove(key)
+
+    def _recycle(self):
+        send, self.buffer = self.buffer, []
+        origins, self.origins = self.origins, []
+        generations, self.generations = self.generations, []
+        self.size = 0
+        self.emitted = 0
+        Stats().count("recycled", len(send))
+        Stats().peak("miner buffer", len(send))
+        self.sink.send(send, origins, generations)
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+from typing import List, Optional
+
+import numpy
+
+from .util import Memory
+
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+
+
+def load(model: str, backend: str = "torch", max_seq_length: Optional[int] = None):
+    """
+    Loads a sentence-transformers model with `backend`: `torch`, or ONNX Runtime with the graph in fp32
+    or with int8 weights, see `OnnxEmbedder`.
+    """
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        embedder = SentenceTransformer(model)
+        if max_seq_length:
+            embedder.max_seq_length = max_seq_length
+        return embedder
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbedder(
+            model, quantize=backend == "onnx-int8", max_seq_length=max_seq_length
+        )
+    raise ValueError(f"unknown embedding backend: {backend}")
+
+
+class OnnxEmbedder:
+    """
+    Runs the transformer of a sentence-transformers model exported to ONNX in one ONNX Runtime session
+    with `threads` intra-op threads, instead of a process per core each holding a copy of the model.
+    Lines are tokenized by `tokenizers`, sorted by length and batched so padding is short, then
+    pooled and normalized as the model is configured. The graph is exported once with torch under
+    `Memory.PATH`, and quantized with int8 weights if `quantize`.
+
+    It has the methods of `SentenceTransformer` which `Cluster` uses, process pools are not needed.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        quantize: bool = False,
+        max_seq_length: Optional[int] = None,
+        threads: int = os.cpu_count(),
+        batch_size: int = 64,
+        path: str = os.path.join(Memory.PATH, "onnx"),
+    ):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "the ONNX embedding backend needs `onnxruntime` and `tokenizers`, please install "
+                "them by `pip install bakalog[onnx]`."
+            )
+
+        self.model = model
+        self.batch_size = batch_size
+        with open(os.path.join(model, "modules.json")) as f:
+            modules = [m["type"].rsplit(".", 1)[-1] for m in json.load(f)]
+        self.normalize = "Normalize" in modules
+        with open(os.path.join(model, "1_Pooling", "config.json")) as f:
+            pooling = json.load(f)
+        self.dim = pooling["word_embedding_dimension"]
+        if pooling.get("pooling_mode_mean_tokens"):
+            self.pooling = "mean"
+        elif pooling.get("pooling_mode_cls_token"):
+            self.pooling = "cls"
+        else:
+            raise ValueError(f"pooling of {model} is not supported by ONNX backend.")
+        if max_seq_length is None:
+            with open(os.path.join(model, "sentence_bert_config.json")) as f:
+                max_seq_length = json.load(f)["max_seq_length"]
+        self.max_seq_length = max_seq_length
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model, "tokenizer.json"))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_seq_length)
+
+        # graphs of the same model files are exported once
+        name = hashlib.sha1(os.path.abspath(model).encode()).hexdigest()[:16]
+        directory = os.path.join(
+            path, f"{os.path.basename(os.path.normpath(model))}-{name}"
+        )
+        graph = os.path.join(directory, "model.onnx")
+        if not os.path.exists(graph):
+            self._export(graph)
+        if quantize:
+            quantized = os.path.join(directory, "model-int8.onnx")
+            if not os.path.exists(quantized):
+                self._quantize(graph, quantized)
+            graph = quantized
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            graph, options, providers=["CPUExecutionProvider"]
+        )
+        self.inputs = {i.name for i in self.session.get_inputs()}
+
+    def _export(self, graph: str):
+        import torch
+        from transformers import AutoModel
+
+        logging.info(f"export {self.model} to ONNX, it is done once.")
+        os.makedirs(os.path.dirname(graph), exist_ok=True)
+        module = AutoModel.from_pretrained(self.model).eval()
+        encoding = self.tokenizer.encode("bakalog exports the model")
+        inputs = {
+            "input_ids": torch.tensor([encoding.ids]),
+            "attention_mask": torch.tensor([encoding.attention_mask]),
+            "token_type_ids": torch.tensor([encoding.type_ids]),
+        }
+        temporary = f"{graph}.{os.getpid()}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                module,
+                (inputs,),
+                temporary,
+                input_names=list(inputs),
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    name: {0: "batch", 1: "sequence"}
+                    for name in [*inputs, "last_hidden_state"]
+                },
+                opset_version=14,
+            )
+        os.replace(temporary, graph)
+
+    @staticmethod
+    def _quantize(graph: str, quantized: str):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logging.info(f"quantize {graph} with int8 weights, it is done once.")
+        temporary = f"{quantized}.{os.getpid()}.tmp"
+        quantize_dynamic(graph, temporary, weight_type=QuantType.QInt8)
+        os.replace(temporary, quantized)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def start_multi_process_pool(self):
+        return None
+
+    def stop_multi_process_pool(self, pool):
+        pass
+
+    def encode_multi_process(self, sentences: List[str], pool=None) -> numpy.ndarray:
+        return self.encode(sentences)
+
+    def encode(self, sentences: List[str]) -> numpy.ndarray:
+        encodings = self.tokenizer.encode_batch(sentences)
+        embeddings = numpy.empty((len(sentences), self.dim), dtype=numpy.float32)
+        # similar lengths are batched together so padding is short
+        order = sorted(range(len(encodings)), key=lambda i: len(encodings[i].ids))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            length = max(len(encodings[i].ids) for i in batch)
+            feed = {
+                name: numpy.zeros((len(batch), length), dtype=numpy.int64)
+                for name in ("input_ids", "attention_mask", "token_type_ids")
+            }
+            for row, i in enumerate(batch):
+                encoding = encodings[i]
+                n = len(encoding.ids)
+                feed["input_ids"][row, :n] = encoding.ids
+                feed["attention_mask"][row, :n] = encoding.attention_mask
+                feed["token_type_ids"][row, :n] = encoding.type_ids
+
+            (hidden,) = self.session.run(
+                ["last_hidden_state"],
+                {name: value for name, value in feed.items() if name in self.inputs},
+            )
+            embeddings[batch] = self._pool(hidden, feed["attention_mask"])
+        return embeddings
+
+    def _pool(self, hidden: numpy.ndarray, mask: numpy.ndarray) -> numpy.ndarray:
+        if self.pooling == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = mask[..., None].astype(hidden.dtype)
+            pooled = (hidden * mask).sum(axis=1) / numpy.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+        if self.normalize:
+            pooled /= numpy.clip(
+                numpy.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None
+            )
+        return pooled
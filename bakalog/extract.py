@@ -1,15 +1,25 @@
 from __future__ import annotations
 
+import hashlib
 import json
 import logging
+import os
+import random
 import re
-from typing import Generator
+import sqlite3
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Generator, List, Optional, Set, Union
 
 import openai
 
 from . import Match
-from .cluster import Cluster
-from .util import Log
+from .guard import review
+from .stats import Stats
+from .util import Batch, Log, Memory
+
+if TYPE_CHECKING:
+    from .cluster import Cluster
+    from .drain import Drain
 
 
 PROMPT = r"""
@@ -72,18 +82,74 @@ PROMPT = r"""
 """
 
 
+class Completions:
+    """
+    Completions kept across runs in a SQLite file under `Memory.PATH`, keyed by a hash of the whole
+    request, so the same samples with the same prompt and parameters are never sent twice.
+    """
+
+    def __init__(self, path: str = Memory.PATH):
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, "completions")
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, completion TEXT)"
+            )
+        self.hits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # requests are sent from a thread pool, each call gets its own connection
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def key(request: dict) -> str:
+        return hashlib.sha256(
+            json.dumps(request, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+
+    def get(self, request: dict) -> Optional[dict]:
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT completion FROM completions WHERE key = ?", (self.key(request),)
+            ).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, request: dict, completion: dict):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?)",
+                (self.key(request), json.dumps(completion)),
+            )
+
+
 def extract(
-    cluster: Cluster,
+    cluster: Union[Cluster, Drain],
     match: Match,
     api_base: str = openai.api_base,
     model: str = "gpt-4",
     temperature: float = 0,
     max_tokens: int = 512,
-) -> Generator[Log, None, None]:
-    openai.api_base = api_base
+    concurrency: int = 4,
+    cache: bool = True,
+    budget: float = 100e-6,
+    holdout: int = 256,
+    retries: int = 1,
+) -> Generator[Union[Log, Batch], None, None]:
+    """
+    Requests run in a thread pool with at most `concurrency` in flight while logs keep flowing, their
+    patterns are sent to `match` as they complete. `None` from `cluster` is a barrier: all requests in
+    flight are waited for, so patterns are learned before logs are recycled.
 
-    def compile(pattern: str) -> re.Pattern:
-        return re.compile(pattern)
+    Patterns are reviewed before they are sent, see `guard.review`. A pattern which doesn't match its
+    samples or takes over `budget` seconds per log is requested again up to `retries` times with the
+    problem, then dropped. `budget` 0 accepts patterns as they are.
+    """
+    openai.api_base = api_base
+    concurrency = max(concurrency, 1)
+    completions = Completions() if cache else None
 
     kwargs = {
         "model": model,
@@ -124,20 +190,28 @@ def extract(
             },
         ]
 
-    for message in cluster:
-        if isinstance(message, Log):
-            yield message
-            continue
-
-        kwargs["messages"] = get_messages(message)
+    def complete(messages: List[dict]) -> dict:
+        request = {**kwargs, "messages": messages}
+        completion = completions.get(request) if completions is not None else None
+        if completion is not None:
+            logging.info(f"cached template of log: {messages[1]['content']}.")
+            Stats().count("cached completions")
+            return completion
 
-        logging.info(f"thinking about the template of log: {message}...")
-        completion = openai.ChatCompletion.create(**kwargs)
+        logging.info(f"thinking about the template of log: {messages[1]['content']}...")
+        with Stats().stage("openai"):
+            completion = openai.ChatCompletion.create(**request)
+        Stats().count("completions")
         assert isinstance(completion, dict)
+        if completions is not None:
+            completions.put(request, completion)
+        return completion
+
+    def compile(completion: dict) -> Optional[re.Pattern]:
         logging.info(f"got {completion['choices'][0]['message']}.")
 
         try:
-            pattern = compile(
+            pattern = re.compile(
                 json.loads(
                     completion["choices"][0]["message"]["function_call"]["arguments"]
                 )["pattern"]
@@ -145,8 +219,7 @@ def extract(
             logging.info(
                 f"extractd regex: {pattern.pattern}",
             )
-            match.send(pattern)
-            continue
+            return pattern
         except Exception as e:
             logging.warning(
                 f"faild to compile regex: {completion}, error: {e}, guessing..."
@@ -159,6 +232,74 @@ def extract(
             logging.info(
                 f"guessing success: {pattern.pattern}",
             )
-            match.send(pattern)
+            return pattern
         except Exception as e:
             logging.error(f"failed to compile regex: {completion}, error: {e}")
+        return None
+
+    def think(samples: List[str], held: List[str]) -> Optional[re.Pattern]:
+        messages = get_messages(samples)
+        for _ in range(retries + 1):
+            completion = complete(messages)
+            pattern = compile(completion)
+            if pattern is None or budget <= 0:
+                return pattern
+
+            pattern, problem = review(pattern, samples, held, budget)
+            if problem is None:
+                logging.info(f"reviewed regex: {pattern.pattern}")
+                return pattern
+
+            logging.warning(f"regex {pattern.pattern} is rejected, {problem}.")
+            messages = [
+                *messages,
+                completion["choices"][0]["message"],
+                {"role": "user", "content": f"{problem}, please try again."},
+            ]
+        return None
+
+    def hold(samples: List[str]) -> List[str]:
+        # the buffer being clustered holds the logs the pattern would be matched against
+        buffer = getattr(cluster, "buffer", [])
+        lines = random.sample(buffer, min(holdout, len(buffer)))
+        return [line for line in lines if line not in samples]
+
+    def learn(done: Set[Future]):
+        for future in done:
+            try:
+                pattern = future.result()
+            except Exception as e:
+                logging.error(f"failed to request the template: {e}")
+                continue
+            if pattern is not None:
+                match.send(pattern)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending: Set[Future] = set()
+
+        for message in Stats().timed("mine", cluster):
+            if isinstance(message, (Log, Batch)):
+                yield message
+                if pending:
+                    done = {future for future in pending if future.done()}
+                    pending -= done
+                    learn(done)
+                continue
+
+            if message is None:
+                learn(wait(pending).done)
+                pending = set()
+                continue
+
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                learn(done)
+            pending.add(executor.submit(think, message, hold(message)))
+            Stats().peak("pending extractions", len(pending))
+
+        learn(wait(pending).done)
+
+    if completions is not None and completions.hits > 0:
+        logging.info(
+            f"{completions.hits} templates are reused from cached completions."
+        )
@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from . import Match, Sink, split
+from .checkpoint import BLOCK_SIZE, Checkpoints
+from .compress import compression
+from .util import Batch, Log
+from .writer import Writer
+
+
+class Cursor:
+    def __init__(self, name: str, f, offset: int, lineno: int):
+        self.name = name
+        self.f = f
+        # offset right after the last complete line read, and its line number
+        self.offset = offset
+        self.lineno = lineno
+        # the partial last line, truncated
+        self.rest = b""
+
+
+class Tail:
+    """
+    Follows files matching `path`, files created later included, and reads complete lines appended to
+    them. Files are tracked by inode and read through open descriptors, so the rest of a rotated file
+    is read before the file which replaced it. A truncated file is read again from the start,
+    compressed files can't be followed and are skipped.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = 512,
+        checkpoints: Optional[Checkpoints] = None,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.checkpoints = checkpoints
+        self.cursors: Dict[int, Cursor] = {}
+        self.skipped = set()
+
+    def poll(self, limit: int = BLOCK_SIZE) -> Iterator[Tuple[str, str, int]]:
+        """
+        Yields lines appended since the last poll with their file and line number, at most `limit`
+        bytes of each file.
+        """
+        found = {}
+        for file in glob.glob(self.path):
+            if file in self.skipped:
+                continue
+            if compression(file) is not None:
+                logging.info(f"skip {file}, compressed logs can't be followed.")
+                self.skipped.add(file)
+                continue
+            try:
+                found[os.stat(file).st_ino] = file
+            except FileNotFoundError:
+                continue
+
+        for inode, file in found.items():
+            cursor = self.cursors.get(inode)
+            if cursor is None:
+                self._open(inode, file)
+            else:
+                # renamed by rotation
+                cursor.name = file
+
+        for inode, cursor in list(self.cursors.items()):
+            read = yield from self._read(cursor, limit)
+            if not read and inode not in found:
+                # rotated out of `path` or removed, and read to the end
+                cursor.f.close()
+                del self.cursors[inode]
+
+    def _open(self, inode: int, file: str):
+        offset, lineno = 0, 0
+        if self.checkpoints is not None:
+            offset, lineno, _ = self.checkpoints.start(file)
+        try:
+            f = open(file, "rb")
+        except FileNotFoundError:
+            return
+        if os.fstat(f.fileno()).st_ino != inode:
+            # replaced since it was found, it is found again by the next poll
+            f.close()
+            return
+        f.seek(offset)
+        logging.info(f"follow {file} from line {lineno + 1}.")
+        self.cursors[inode] = Cursor(file, f, offset, lineno)
+
+    def _read(self, cursor: Cursor, limit: int):
+        if os.fstat(cursor.f.fileno()).st_size < cursor.f.tell():
+            logging.warning(f"{cursor.name} is truncated, read it from the start.")
+            cursor.f.seek(0)
+            cursor.offset, cursor.lineno, cursor.rest = 0, 0, b""
+
+        block = cursor.f.read(limit)
+        if not block:
+            return False
+
+        block = cursor.rest + block
+        cut = block.rfind(b"\n") + 1
+        if cut == 0:
+            cursor.rest = block[: self.max_size]
+            return True
+
+        cursor.offset = cursor.f.tell() - (len(block) - cut)
+        for line in split(block, 0, cut, self.max_size):
+            cursor.lineno += 1
+            yield line, cursor.name, cursor.lineno
+        cursor.rest = block[cut:][: self.max_size]
+        return True
+
+    def checkpoint(self):
+        """
+        Commits offsets of lines read so far, call it once they are written.
+        """
+        if self.checkpoints is None:
+            return
+        for inode, cursor in self.cursors.items():
+            try:
+                if os.stat(cursor.name).st_ino != inode:
+                    continue
+            except FileNotFoundError:
+                continue
+            self.checkpoints.done(cursor.name, cursor.offset, cursor.lineno, False)
+        self.checkpoints.commit()
+
+    def close(self):
+        for cursor in self.cursors.values():
+            cursor.f.close()
+        self.cursors = {}
+
+
+class Backlog(Sink):
+    """
+    Lines left unmatched while following, read by the learning thread. A round of mining ends with
+    `None` once lines were read for `round_time` seconds or the backlog is idle, lines recycled by the
+    miner are read first.
+    """
+
+    def __init__(self, lines: queue.Queue, max_size: int = 512, round_time=5.0):
+        super().__init__("", max_size=max_size)
+        self.lines = lines
+        self.round_time = round_time
+
+    def __iter__(self):
+        read, started = 0, time.monotonic()
+        while True:
+            while len(self.buffer) != 0:
+                line, self.source, self.lineno, self.generation = self.buffer.pop()
+                read += 1
+                yield line
+
+            try:
+                line, self.source, self.lineno, self.generation = self.lines.get(
+                    timeout=max(started + self.round_time - time.monotonic(), 0.01)
+                )
+                read += 1
+                yield line
+            except queue.Empty:
+                pass
+
+            if time.monotonic() - started >= self.round_time:
+                if read > 0:
+                    yield None
+                read, started = 0, time.monotonic()
+
+
+class Learner(Match):
+    """
+    Match of the learning thread, it starts from the patterns of the following thread, in the same
+    order so generations of queued lines hold, and patterns it learns are queued for it.
+    """
+
+    def __init__(self, match: Match, sink: Sink, learned: queue.Queue):
+        super().__init__(match.memory, sink, list(match.patterns))
+        self.learned = learned
+
+    def send(self, pattern):
+        super().send(pattern)
+        self.learned.put(pattern)
+
+
+def percentiles(
+    samples: Iterable[Tuple[float, int]], qs: List[float]
+) -> List[Optional[float]]:
+    # samples are values with their weight
+    samples = sorted(samples)
+    total = sum(n for _, n in samples)
+    result = []
+    for q in qs:
+        rank, seen, value = q * total, 0, None
+        for value, n in samples:
+            seen += n
+            if seen >= rank:
+                break
+        result.append(value)
+    return result
+
+
+class Follow:
+    """
+    Matches lines appended to followed files as soon as they are read, and writes them in micro
+    batches, once `batch_size` rows are pending or the oldest pending row waited `interval` seconds.
+    Unmatched lines are queued, up to `backlog` lines, for a background thread which mines and
+    extracts them with `learn`, so templates are learned without stopping ingestion. Learned patterns
+    are matched from the next poll, and logs the learning thread matches are written too.
+
+    `latency` is the seconds between reading a matched line and writing it: the median, the 99th
+    percentile and the maximum of the last written rows. Offsets are committed after each write,
+    unmatched lines waiting to be learned are lost if following stops.
+    """
+
+    def __init__(
+        self,
+        tail: Tail,
+        match: Match,
+        writer: Writer,
+        learn: Callable[[Sink, Match], Iterable[Union[Log, Batch]]],
+        batch_size: int = 8192,
+        interval: float = 1.0,
+        poll: float = 0.2,
+        backlog: int = 100000,
+        round_time: float = 5.0,
+        report: float = 10.0,
+    ):
+        self.tail = tail
+        self.match = match
+        self.writer = writer
+        self.learn = learn
+        self.batch_size = batch_size
+        self.interval = interval
+        self.poll = poll
+        self.report = report
+        self.round_time = round_time
+
+        self.unmatched: queue.Queue = queue.Queue(maxsize=backlog)
+        self.learned: queue.Queue = queue.Queue()
+        self.logs: queue.Queue = queue.Queue()
+        # read time and number of rows of each poll not written yet
+        self.pending: List[Tuple[float, int]] = []
+        self.latencies = deque(maxlen=4096)
+        self.latency = {"p50": None, "p99": None, "max": None}
+        self.lines = 0
+        self.matched = 0
+        self.dropped = 0
+
+    def run(self):
+        sink = Backlog(self.unmatched, self.tail.max_size, self.round_time)
+        learner = Learner(self.match, sink, self.learned)
+        thread = threading.Thread(target=self._learn, args=(sink, learner), daemon=True)
+        thread.start()
+
+        flushed = reported = time.monotonic()
+        try:
+            while True:
+                self._patterns()
+                read, lines, rows = time.monotonic(), 0, 0
+                for line, source, lineno in self.tail.poll():
+                    lines += 1
+                    log = self.match.match(line, (source, lineno))
+                    if log is None:
+                        self._queue(line, source, lineno)
+                        continue
+                    self.writer.append(log)
+                    rows += 1
+                self.lines += lines
+                if rows > 0:
+                    self.pending.append((read, rows))
+                    self.matched += rows
+                self._logs()
+
+                now = time.monotonic()
+                waited = now - self.pending[0][0] if self.pending else 0
+                if (
+                    sum(n for _, n in self.pending) >= self.batch_size
+                    or waited >= self.interval
+                ):
+                    self._flush()
+                    flushed = now
+                elif now - flushed >= self.interval:
+                    # rows the learning thread matched have no read time
+                    self._flush()
+                    flushed = now
+
+                if now - reported >= self.report:
+                    self._report(now - reported)
+                    reported = now
+                if lines == 0:
+                    time.sleep(self.poll)
+        finally:
+            self._flush()
+            self.tail.close()
+            self._report(time.monotonic() - reported)
+
+    def _queue(self, line: str, source: str, lineno: int):
+        try:
+            self.unmatched.put_nowait((line, source, lineno, len(self.match.patterns)))
+        except queue.Full:
+            self.dropped += 1
+
+    def _patterns(self):
+        while True:
+            try:
+                pattern = self.learned.get_nowait()
+            except queue.Empty:
+                return
+            self.match.send(pattern)
+
+    def _logs(self):
+        while True:
+            try:
+                log = self.logs.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(log, Batch):
+                self.writer.extend(log)
+            else:
+                self.writer.append(log)
+
+    def _learn(self, sink: Backlog, learner: Learner):
+        try:
+            for log in self.learn(sink, learner):
+                if log is not None:
+                    self.logs.put(log)
+        except Exception:
+            logging.exception(
+                "templates are not learned anymore, logs are still matched."
+            )
+
+    def _flush(self):
+        self.writer.flush()
+        self.tail.checkpoint()
+        self.match.memory.flush()
+        written = time.monotonic()
+        for read, n in self.pending:
+            self.latencies.append((written - read, n))
+        self.pending = []
+        if self.latencies:
+            p50, p99 = percentiles(self.latencies, [0.5, 0.99])
+            self.latency = {
+                "p50": p50,
+                "p99": p99,
+                "max": max(l for l, _ in self.latencies),
+            }
+
+    def _report(self, elapsed: float):
+        def ms(seconds):
+            return "-" if seconds is None else f"{format(seconds * 1000, '.0f')}ms"
+
+        logging.info(
+            f"followed {self.lines} logs, {format(self.lines / max(elapsed, 1e-9), '.2f')} logs/s, "
+            f"{self.matched} matched, {self.unmatched.qsize()} waiting to be learned, "
+            f"{self.dropped} dropped, read to written latency p50 {ms(self.latency['p50'])} "
+            f"p99 {ms(self.latency['p99'])} max {ms(self.latency['max'])}."
+        )
+        self.lines = self.matched = 0
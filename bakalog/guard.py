@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import re
+import time
+from typing import List, Optional, Sequence, Tuple
+
+# a group which captures anything, `(.+)`, `(.*?)` or `(?P<name>.+)`
+GROUP = re.compile(r"(?<!\\)\((\?P<\w+>)?\.([+*])\??\)")
+# a single literal, escaped character or character class escape
+NEXT = re.compile(r"\\[^bBAZ0-9x]|[^.^$*+?{}\[\]|()\\]")
+
+
+def groups(pattern: re.Pattern, lines: Sequence[str]) -> List[Optional[Tuple]]:
+    result = []
+    for line in lines:
+        match = pattern.match(line)
+        result.append(None if match is None else match.groups())
+    return result
+
+
+def tighten(pattern: re.Pattern, samples: Sequence[str]) -> re.Pattern:
+    """
+    Rewrites groups capturing anything into `\\d+`, or into a class stopping at the literal
+    following the group, e.g. `(.+)\\]` into `([^\\]]+)\\]`. A rewrite is kept only if every
+    sample is matched with exactly the same groups.
+    """
+    expected = groups(pattern, samples)
+    source = pattern.pattern
+
+    found = GROUP.search(source)
+    while found is not None:
+        name, quantifier = found.group(1) or "", found.group(2)
+        candidates = [r"\d"]
+        after = NEXT.match(source, found.end())
+        if after is not None:
+            stop = after.group()
+            if not stop.startswith("\\"):
+                stop = re.escape(stop)
+            candidates.append(f"[^{stop}]")
+
+        for candidate in candidates:
+            rewritten = (
+                f"{source[: found.start()]}({name}{candidate}{quantifier})"
+                f"{source[found.end() :]}"
+            )
+            try:
+                compiled = re.compile(rewritten, pattern.flags)
+            except re.error:
+                continue
+            if groups(compiled, samples) == expected:
+                source = rewritten
+                break
+
+        found = GROUP.search(source, found.start() + 1)
+
+    return pattern if source == pattern.pattern else re.compile(source, pattern.flags)
+
+
+def near_misses(samples: Sequence[str], step: int = 4) -> List[str]:
+    """
+    Growing prefixes of the samples, which fail late and make patterns backtrack the most. Lengths
+    grow slowly, so a pattern backtracking exponentially is over budget before it takes forever.
+    """
+    lines = []
+    for length in range(step, max(len(s) for s in samples) + step, step):
+        lines += [f"{s[:length]}\0" for s in samples if len(s) >= length - step]
+    return lines
+
+
+def pumped(samples: Sequence[str], step: int = 4, longest: int = 64) -> List[str]:
+    """
+    Samples with the first character of each word repeated in growing runs, failing at the end.
+    Nested quantifiers like `(a+)+` backtrack exponentially on them, while samples are too short
+    to show it.
+    """
+    lines = []
+    for sample in samples:
+        starts = {0, *(word.start() for word in re.finditer(r"\w+", sample))}
+        for length in range(step, longest + step, step):
+            lines += [
+                f"{sample[:i]}{sample[i] * length}{sample[i:]}\0"
+                for i in sorted(starts)
+                if i < len(sample)
+            ]
+    return lines
+
+
+def prefixes(lines: Sequence[str], shortest: int = 16) -> List[str]:
+    """
+    Prefixes of the lines doubling in length, then the lines. A pattern backtracking polynomially
+    takes long on a long line, it is over budget on a shorter prefix first.
+    """
+    result = []
+    length = shortest
+    while length < max(map(len, lines), default=0):
+        result += [line[:length] for line in lines if len(line) > length]
+        length *= 2
+    return result + list(lines)
+
+
+def cost(pattern: re.Pattern, lines: Sequence[str], budget: float) -> float:
+    """
+    Mean CPU seconds of the current thread spent to match a line, other threads don't count. It
+    stops at the first line which takes 100 times the budget, lines are matched from the shortest.
+    """
+    lines = sorted(lines, key=len)
+    total = 0.0
+    for line in lines:
+        started = time.thread_time()
+        pattern.match(line)
+        elapsed = time.thread_time() - started
+        if elapsed > budget * 100:
+            return elapsed
+        total += elapsed
+    return total / max(len(lines), 1)
+
+
+def review(
+    pattern: re.Pattern, samples: Sequence[str], holdout: Sequence[str], budget: float
+) -> Tuple[re.Pattern, Optional[str]]:
+    """
+    Validates the pattern against its samples, tightens it and benchmarks it on held out logs, their
+    prefixes, and near misses and pumped copies of the samples. Returns the tightened pattern and
+    the problem found, if any.
+    """
+    for sample, match in zip(samples, groups(pattern, samples)):
+        if match is None:
+            return pattern, f"the pattern doesn't match the log: {sample}"
+
+    pattern = tighten(pattern, samples)
+    spent = cost(
+        pattern, [*near_misses(samples), *pumped(samples), *prefixes(holdout)], budget
+    )
+    if spent > budget:
+        return pattern, (
+            f"the pattern takes {format(spent * 1e6, '.1f')}us to match a log, over the budget of "
+            f"{format(budget * 1e6, '.1f')}us, it backtracks too much"
+        )
+    return pattern, None
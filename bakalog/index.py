@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
+
+
+def literals(pattern: re.Pattern) -> Tuple[str, List[str]]:
+    """
+    Returns the literal prefix of the pattern and every run of literal characters
+    which must appear in a matched line. Both are empty if they can't be proved.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return "", []
+
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return "", []
+
+    runs, run = [], []
+    prefix = None
+
+    def walk(items):
+        nonlocal prefix, run
+
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                run.append(chr(av))
+                continue
+
+            if op is sre_parse.SUBPATTERN:
+                _, add_flags, _, p = av
+                if not add_flags & re.IGNORECASE:
+                    walk(p)
+                    continue
+
+            if op is sre_parse.AT and av is sre_parse.AT_BEGINNING and prefix is None:
+                continue
+
+            if prefix is None:
+                prefix = "".join(run)
+            if run:
+                runs.append("".join(run))
+                run = []
+
+    walk(parsed)
+    if prefix is None:
+        prefix = "".join(run)
+    if run:
+        runs.append("".join(run))
+
+    return prefix, runs
+
+
+class Index:
+    """
+    Dispatches lines to the patterns which could match them. Patterns are put in a trie of their literal
+    prefixes, and each candidate is checked for its longest required literal before the regex runs.
+    Candidates are tried in insertion order, so the first matched pattern is the same as a linear scan.
+    """
+
+    MAX_DEPTH = 64
+
+    def __init__(self, patterns: List[re.Pattern] = ()):
+        self.patterns: List[re.Pattern] = []
+        self.required: List[str] = []
+        self.trie: Dict = {}
+        self.unprefixed: List[int] = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def add(self, pattern: re.Pattern):
+        id = len(self.patterns)
+        prefix, runs = literals(pattern)
+
+        self.required.append(max(runs, key=len, default=""))
+        self.patterns.append(pattern)
+
+        prefix = prefix[: self.MAX_DEPTH]
+        if prefix == "":
+            self.unprefixed.append(id)
+            return
+
+        node = self.trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append(id)
+
+    def candidates(self, line: str) -> List[int]:
+        ids = []
+        node = self.trie
+        for char in line[: self.MAX_DEPTH]:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                ids += node[None]
+
+        if len(ids) == 0:
+            return self.unprefixed
+        ids += self.unprefixed
+        ids.sort()
+        return ids
+
+    def match(self, line: str, start: int = 0) -> Optional[Tuple[re.Pattern, re.Match]]:
+        for id in self.candidates(line):
+            if id < start or self.required[id] not in line:
+                continue
+            regex = self.patterns[id]
+            match = regex.match(line)
+            if match is not None:
+                return regex, match
+        return None
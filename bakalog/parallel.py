@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import contextlib
+import itertools
+import logging
+import mmap
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import Match, Sink, split, stream
+from .compress import compression, decompress
+from .index import Index
+from .stats import Stats
+from .util import Batch, Memory
+
+
+def chunks(
+    ranges: List[Tuple[str, int, Optional[int]]], chunk_size: int
+) -> Iterator[Tuple[str, int, Optional[int]]]:
+    """
+    Splits byte ranges of files into ranges of about `chunk_size`, each range ends right after a
+    newline. Compressed files can't be split, they are scanned as one range from the start offset.
+    """
+    for file, start, size in ranges:
+        if size is None:
+            yield file, start, None
+            continue
+        with open(file, "rb") as f:
+            while start < size:
+                end = start + chunk_size
+                if end < size:
+                    f.seek(end)
+                    f.readline()
+                    end = min(f.tell(), size)
+                else:
+                    end = size
+                yield file, start, end
+                start = end
+
+
+_index = Index()
+
+
+def scan(file: str, start: int, end: Optional[int], patterns: List[str], max_size: int):
+    """
+    Matches lines of a byte range in a worker process, patterns only grow so the index of the worker
+    is extended rather than rebuilt. Returns the number of lines, matched groups in columns of each
+    pattern, unmatched lines and the offset of the end, line numbers are relative to the range.
+    Offsets of compressed files are in decompressed bytes.
+    """
+    global _index
+
+    if [p.pattern for p in _index.patterns] != patterns[: len(_index)]:
+        _index = Index()
+    for pattern in patterns[len(_index) :]:
+        _index.add(re.compile(pattern))
+
+    batches: Dict[str, Tuple[List[List[str]], List[int]]] = {}
+    unmatched = []
+    lineno = -1
+    with contextlib.ExitStack() as stack:
+        codec = compression(file)
+        if codec is not None:
+            f = stack.enter_context(decompress(file, codec))
+            if start > 0:
+                f.seek(start)
+            lines = itertools.chain.from_iterable(stream(f.read, max_size))
+        else:
+            f = stack.enter_context(open(file, "rb"))
+            buf = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            lines = split(buf, start, end, max_size)
+
+        for lineno, line in enumerate(lines):
+            found = _index.match(line)
+            if found is None:
+                unmatched.append((lineno, line))
+                continue
+
+            regex, match = found
+            groups = match.groups()
+            if regex.pattern not in batches:
+                batches[regex.pattern] = ([[] for _ in groups], [])
+            columns, linenos = batches[regex.pattern]
+            for column, value in zip(columns, groups):
+                column.append(value)
+            linenos.append(lineno)
+        # compressed chunks end where decompression stopped, before the file is closed
+        offset = end if codec is None else f.tell()
+
+    return lineno + 1, batches, unmatched, offset
+
+
+class ParallelMatch(Match):
+    """
+    Matches file chunks in a process pool and yields columnar batches. Lines unmatched by a worker are
+    re-checked against patterns learned since the chunk was submitted, lines recycled by `Cluster` are
+    matched in-process as `Match` does.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        sink: Sink,
+        workers: int = os.cpu_count(),
+        chunk_size: int = 16 * 1024 * 1024,
+    ):
+        super().__init__(memory, sink)
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        yield from self._scan(self.sink.files())
+        yield from self._match(Stats().timed("read", self.sink.drain(())))
+
+    def _scan(self, files: List[str]):
+        ranges = [(file, *self.sink.range(file)) for file in files]
+        tasks = chunks(
+            [(file, start, end) for file, start, end, _ in ranges], self.chunk_size
+        )
+        pending = deque()
+        linenos: Dict[str, int] = {file: base for file, _, _, base in ranges}
+        ends = {file: end for file, _, end, _ in ranges}
+
+        def submit():
+            for task in tasks:
+                patterns = [p.pattern for p in self.patterns]
+                future = executor.submit(scan, *task, patterns, self.sink.max_size)
+                pending.append((task, len(patterns), future))
+                if len(pending) >= 2 * self.workers:
+                    break
+
+        executor = ProcessPoolExecutor(self.workers)
+        logging.info(f"matching {len(files)} files with {self.workers} workers.")
+        try:
+            submit()
+            while len(pending) != 0:
+                (file, start, end), generation, future = pending.popleft()
+                count, batches, unmatched, offset = future.result()
+                submit()
+                Stats().count("bytes", offset - start)
+
+                base = linenos[file] + 1
+                linenos[file] += count
+
+                # the chunk is committed before its last log is yielded, `collect` only stops once
+                # it is written as a whole
+                self.sink.chunk = (file, start, end)
+                left = len(batches) + len(unmatched)
+                if left == 0:
+                    self._done(file, offset, linenos[file], end == ends[file])
+
+                for pattern, (columns, numbers) in batches.items():
+                    self.hits[pattern] += len(numbers)
+                    left -= 1
+                    if left == 0:
+                        self._done(file, offset, linenos[file], end == ends[file])
+                    yield Batch(pattern, columns, file, [base + n for n in numbers])
+
+                for lineno, line in unmatched:
+                    self.origin = (file, base + lineno)
+                    log = self.match(line, self.origin, start=generation)
+                    self.generation = len(self.patterns)
+                    left -= 1
+                    if left == 0:
+                        self._done(file, offset, linenos[file], end == ends[file])
+                    yield line if log is None else log
+        finally:
+            self.sink.chunk = None
+            executor.shutdown(cancel_futures=True)
+
+    def _done(self, file: str, offset: int, lineno: int, complete: bool):
+        self.sink.done(file, offset, lineno, complete)
+        self.sink.chunk = None
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import socket
+import time
+from typing import Any, Dict, Optional
+
+from . import Match, Sink, collect
+from .checkpoint import Checkpoints
+from .client import SOCKET
+from .extract import extract
+from .parallel import ParallelMatch
+from .util import Memory, parse_size
+from .writer import Writer
+
+
+class Server:
+    """
+    Keeps the embedding model with its process pool, the patterns and the writer of `output` resident,
+    and runs requests of `bakalog.client` one at a time over a Unix socket: `ingest` collects logs
+    into the output as `bakalog run` does, `query` runs SQL on it. `extraction` are the arguments of
+    `extract` for every job. `fresh` is whether the output was created by the server, checkpoints of
+    an output removed before are dropped then. Jobs embed logs with `backend`, see `Cluster`.
+    """
+
+    def __init__(
+        self,
+        writer: Writer,
+        output: Optional[str] = None,
+        path: str = SOCKET,
+        warm: bool = True,
+        fresh: bool = False,
+        backend: str = "torch",
+        max_seq_length: Optional[int] = None,
+        **extraction,
+    ):
+        self.writer = writer
+        self.output = output
+        self.path = path
+        self.fresh = fresh
+        self.ingested = set()
+        self.backend = backend
+        self.max_seq_length = max_seq_length
+        self.extraction = extraction
+        if warm:
+            from .cluster import warm
+
+            started = time.perf_counter()
+            warm(backend=backend, max_seq_length=max_seq_length)
+            logging.info(
+                f"the embedding model is warm in {format(time.perf_counter() - started, '.2f')}s."
+            )
+
+    def serve(self):
+        if os.path.exists(self.path):
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                    s.connect(self.path)
+                logging.error(f"bakalog already serves on {self.path}.")
+                return
+            except ConnectionRefusedError:
+                # left by a server which didn't stop cleanly
+                os.remove(self.path)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.bind(self.path)
+            os.chmod(self.path, 0o600)
+            s.listen()
+            logging.info(f"serve on {self.path}.")
+            try:
+                while True:
+                    conn, _ = s.accept()
+                    with conn, conn.makefile("rwb") as f:
+                        line = f.readline()
+                        if not line:
+                            continue
+                        response = self.handle(json.loads(line))
+                        f.write(json.dumps(response, default=str).encode() + b"\n")
+                        f.flush()
+            finally:
+                os.remove(self.path)
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            if request.get("command") == "ingest":
+                return self.ingest(request["file"], **request.get("options", {}))
+            if request.get("command") == "query":
+                return self.query(request["sql"])
+            return {"error": f"unknown command: {request.get('command')}"}
+        except Exception as e:
+            logging.exception(f"failed to handle {request}.")
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def ingest(
+        self,
+        file: str,
+        max_lines=4096,
+        buf_size="2MB",
+        max_len=512,
+        threshold=0.85,
+        workers=1,
+        reader="text",
+        dedup=True,
+        engine="exact",
+        miner="embedding",
+        max_communities=3,
+        resume=True,
+    ) -> Dict[str, Any]:
+        started, rows = time.perf_counter(), self.writer.rows
+        with Memory().current(file):
+            checkpoints = None
+            if self.output:
+                files = Memory().load("checkpoints", {})
+                if self.fresh and file not in self.ingested:
+                    files.pop(os.path.abspath(self.output), None)
+                checkpoints = Checkpoints(
+                    files.setdefault(os.path.abspath(self.output), {}), resume=resume
+                )
+            f = Sink(file, max_size=max_len, reader=reader, checkpoints=checkpoints)
+            if workers > 1:
+                m = ParallelMatch(Memory(), f, workers=workers)
+            else:
+                m = Match(Memory(), f)
+            if miner == "drain":
+                from .drain import Drain
+
+                c = Drain(f, m, buf_size=parse_size(buf_size))
+            else:
+                from .cluster import Cluster
+
+                c = Cluster(
+                    f,
+                    m,
+                    buf_size=parse_size(buf_size),
+                    threshold=threshold,
+                    dedup=dedup,
+                    engine=engine,
+                    max_communities=max_communities,
+                    backend=self.backend,
+                    max_seq_length=self.max_seq_length,
+                )
+            collect(
+                extract(c, m, **self.extraction),
+                max_lines,
+                writer=self.writer,
+                sink=f,
+            )
+            f.checkpoint()
+            self.ingested.add(file)
+
+        return {
+            "rows": self.writer.rows - rows,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def query(self, sql: str) -> Dict[str, Any]:
+        cursor = self.writer.db.execute(sql)
+        columns = [d[0] for d in cursor.description or []]
+        return {"columns": columns, "rows": cursor.fetchall() if columns else []}
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterable, List, Optional
+
+from .util import Batch, Singleton
+
+DONE = object()
+
+
+class Stats(Singleton):
+    """
+    Wall and CPU time of each stage of the pipeline, counts, peaks of buffers and queues, and the cost
+    of patterns sampled from one of `every` matches. A stage excludes time spent in stages it waits
+    on, e.g. `match` excludes the `read` of the lines it matches, so stages add up to the run. Times
+    are per thread, OpenAI requests overlap the rest of the pipeline. Nothing is measured until
+    `enable`, measuring adds some overhead to each line.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.every = 64
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counts: Counter = Counter()
+        self.peaks: Dict[str, int] = {}
+        # samples and seconds of matches by pattern, None for lines no pattern matches
+        self.costs: Dict[Optional[str], List[float]] = {}
+        self.matches = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, every: int = 64):
+        self.enabled = True
+        self.every = every
+        self.started = time.perf_counter()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(name)
+
+    @contextmanager
+    def _stage(self, name: str):
+        started = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name, started, 0)
+
+    def timed(self, name: str, iterable: Iterable) -> Iterable:
+        """
+        Iterates `iterable` as the stage `name`, lines and logs it yields are its items.
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed(name, iterable)
+
+    def _timed(self, name: str, iterable: Iterable):
+        iterator = iter(iterable)
+        while True:
+            item = DONE
+            started = self._enter()
+            try:
+                item = next(iterator, DONE)
+            finally:
+                if item is None or item is DONE:
+                    items = 0
+                elif isinstance(item, Batch):
+                    items = len(item)
+                else:
+                    items = 1
+                self._exit(name, started, items)
+            if item is DONE:
+                return
+            yield item
+
+    def _enter(self):
+        frames = self.local.__dict__.setdefault("frames", [])
+        # wall and CPU time of stages inside
+        frames.append([0.0, 0.0])
+        return time.perf_counter(), time.thread_time()
+
+    def _exit(self, name: str, started, items: int):
+        wall = time.perf_counter() - started[0]
+        cpu = time.thread_time() - started[1]
+        frames = self.local.frames
+        inner = frames.pop()
+        if frames:
+            frames[-1][0] += wall
+            frames[-1][1] += cpu
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = dict(wall=0.0, cpu=0.0, calls=0, items=0)
+            stage["wall"] += wall - inner[0]
+            stage["cpu"] += cpu - inner[1]
+            stage["calls"] += 1
+            stage["items"] += items
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            with self.lock:
+                self.counts[name] += n
+
+    def peak(self, name: str, value: int):
+        if self.enabled and value > self.peaks.get(name, 0):
+            self.peaks[name] = value
+
+    def sampled(self) -> bool:
+        self.matches += 1
+        return self.matches % self.every == 0
+
+    def cost(self, pattern: Optional[str], seconds: float):
+        cost = self.costs.setdefault(pattern, [0, 0.0])
+        cost[0] += 1
+        cost[1] += seconds
+
+    def metrics(self, hits: Optional[Counter] = None) -> Dict[str, Any]:
+        """
+        Everything measured so far as JSON, patterns by `hits` of the run.
+        """
+        stages = {}
+        for name, stage in self.stages.items():
+            stages[name] = {
+                **stage,
+                "items_per_second": stage["items"] / max(stage["wall"], 1e-9),
+            }
+
+        patterns = []
+        for pattern, n in (hits or Counter()).most_common():
+            sampled, seconds = self.costs.get(pattern, (0, 0.0))
+            patterns.append(
+                {
+                    "pattern": pattern,
+                    "hits": n,
+                    "sampled": sampled,
+                    "mean_us": seconds / sampled * 1e6 if sampled else None,
+                }
+            )
+        sampled, seconds = self.costs.get(None, (0, 0.0))
+
+        return {
+            "elapsed": time.perf_counter() - self.started,
+            "stages": stages,
+            "counts": dict(self.counts),
+            "peaks": dict(self.peaks),
+            "patterns": patterns,
+            "unmatched": {
+                "sampled": sampled,
+                "mean_us": seconds / sampled * 1e6 if sampled else None,
+            },
+        }
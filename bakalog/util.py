@@ -1,9 +1,14 @@
 import contextlib
 import json
+import logging
 import os
 import re
+import sqlite3
+import time
+from array import array
+from collections import Counter
 from dataclasses import dataclass
-from typing import Any, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 
 @dataclass
@@ -11,6 +16,87 @@ class Log:
     pattern: str
     content: str
     groups: Tuple[str, ...]
+    source: Optional[str] = None
+    lineno: Optional[int] = None
+
+
+@dataclass
+class Batch:
+    pattern: str
+    columns: List[List[str]]
+    source: str
+    lineno: List[int]
+
+    def __len__(self):
+        return len(self.lineno)
+
+    def head(self, n: int) -> "Batch":
+        if n >= len(self):
+            return self
+        return Batch(
+            self.pattern,
+            [column[:n] for column in self.columns],
+            self.source,
+            self.lineno[:n],
+        )
+
+
+class Arena:
+    """
+    Lines packed in one bytearray with their offsets, origins and pattern generations, the number of
+    patterns each line was already matched against. A list of str and tuples costs about 100 bytes
+    per line on top of the text, which adds up when large backlogs of unmatched logs are recycled.
+    Lines are popped in LIFO order.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.data = bytearray()
+        self.offsets = array("Q", [0])
+        self.sources: List[Optional[str]] = [None]
+        self.ids: Dict[Optional[str], int] = {None: 0}
+        self.source_ids = array("L")
+        # -1 marks an unknown line number
+        self.linenos = array("q")
+        self.generations = array("L")
+
+    def __len__(self):
+        return len(self.linenos)
+
+    def append(
+        self,
+        line: str,
+        source: Optional[str] = None,
+        lineno: Optional[int] = None,
+        generation: int = 0,
+    ):
+        self.data += line.encode("utf-8", "surrogatepass")
+        self.offsets.append(len(self.data))
+        key = self.ids.get(source)
+        if key is None:
+            key = self.ids[source] = len(self.sources)
+            self.sources.append(source)
+        self.source_ids.append(key)
+        self.linenos.append(-1 if lineno is None else lineno)
+        self.generations.append(generation)
+
+    def pop(self) -> Tuple[str, Optional[str], Optional[int], int]:
+        self.offsets.pop()
+        start = self.offsets[-1]
+        line = self.data[start:].decode("utf-8", "surrogatepass")
+        del self.data[start:]
+        source = self.sources[self.source_ids.pop()]
+        lineno = self.linenos.pop()
+        generation = self.generations.pop()
+        if len(self) == 0:
+            self.clear()
+        return line, source, None if lineno < 0 else lineno, generation
+
+    def origins(self) -> Iterator[Tuple[Optional[str], Optional[int]]]:
+        for key, lineno in zip(self.source_ids, self.linenos):
+            yield self.sources[key], None if lineno < 0 else lineno
 
 
 class SingletonMeta(type):
@@ -42,42 +128,156 @@ class Serializer(json.JSONEncoder, metaclass=SingletonMeta):
 
 
 class Memory(Singleton):
+    """
+    Patterns and other fields of each log source kept across runs in a SQLite file under `PATH`.
+    Patterns are inserted one by one as they are learned, so concurrent runs share them, and loaded
+    with the most matched first. Hits are added up and other fields are written back as JSON by
+    `flush`, only top-level keys of a field changed by this run overwrite those of other runs.
+    """
+
     home = os.environ["HOME"]
     PATH = f"{home}/.bakalog"
 
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS patterns (
+            id INTEGER PRIMARY KEY,
+            source TEXT NOT NULL,
+            pattern TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created REAL,
+            last_used REAL,
+            UNIQUE (source, pattern)
+        );
+        CREATE INDEX IF NOT EXISTS patterns_hits ON patterns (source, hits DESC);
+        CREATE INDEX IF NOT EXISTS patterns_pattern ON patterns (pattern);
+        CREATE TABLE IF NOT EXISTS fields (
+            source TEXT NOT NULL,
+            field TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (source, field)
+        );
+    """
+
     def __init__(
         self,
     ):
-        if not os.path.exists(self.PATH):
-            os.mkdir(self.PATH)
+        os.makedirs(self.PATH, exist_ok=True)
+        self.path = os.path.join(self.PATH, "memory.db")
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(self.SCHEMA)
+        self._migrate()
+        self.source = None
+        self.fields: Dict[str, Any] = {}
+        self.loaded: Dict[str, Any] = {}
+        # hits of each pattern not written yet
+        self.hits: Counter = Counter()
+
+    def _connect(self) -> sqlite3.Connection:
+        # the learning thread of `bakalog follow` gets its own connection
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _migrate(self):
+        legacy = os.path.join(self.PATH, "patterns")
+        if not os.path.exists(legacy):
+            return
+        with open(legacy) as f:
+            all = json.loads(f.read() or "{}")
+        with self._connect() as db:
+            for source, fields in all.items():
+                db.executemany(
+                    "INSERT OR IGNORE INTO patterns (source, pattern, created) VALUES (?, ?, ?)",
+                    [(source, p, time.time()) for p in fields.pop("patterns", [])],
+                )
+                db.executemany(
+                    "INSERT OR IGNORE INTO fields VALUES (?, ?, ?)",
+                    [(source, k, json.dumps(v)) for k, v in fields.items()],
+                )
+        with contextlib.suppress(FileNotFoundError):
+            os.replace(legacy, f"{legacy}.migrated")
+            logging.info(
+                f"patterns of {len(all)} log files are migrated to {self.path}."
+            )
 
     @contextlib.contextmanager
     def current(self, file: str):
-        with open(f"{self.PATH}/patterns", "a+") as f:
-            f.seek(0)
-            if f.read() == "":
-                f.write(r"{}")
-                f.seek(0)
-            f.seek(0)
-            all = json.loads(f.read())
-            if file not in all:
-                all[file] = {}
-            self.memory = all[file]
-            try:
-                yield
-            finally:
-                f.seek(0)
-                f.truncate()
-                f.write(json.dumps(all, cls=Serializer))
+        self.source, self.fields, self.loaded = file, {}, {}
+        self.hits.clear()
+        try:
+            yield
+        finally:
+            self.flush()
 
     @classmethod
     def serialize(cls, type, serializer):
         Serializer().register(type, serializer)
 
     def load(self, field, init):
-        if field not in self.memory:
-            self.memory[field] = init
-        return self.memory[field]
+        if field not in self.fields:
+            with self._connect() as db:
+                row = db.execute(
+                    "SELECT value FROM fields WHERE source = ? AND field = ?",
+                    (self.source, field),
+                ).fetchone()
+            self.fields[field] = init if row is None else json.loads(row[0])
+            self.loaded[field] = self._copy(self.fields[field])
+        return self.fields[field]
+
+    @staticmethod
+    def _copy(value):
+        return json.loads(json.dumps(value, cls=Serializer))
+
+    def patterns(self) -> List[str]:
+        with self._connect() as db:
+            return [
+                pattern
+                for (pattern,) in db.execute(
+                    "SELECT pattern FROM patterns WHERE source = ? ORDER BY hits DESC, id",
+                    (self.source,),
+                )
+            ]
+
+    def learn(self, pattern: str):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO patterns (source, pattern, created) VALUES (?, ?, ?)",
+                (self.source, pattern, time.time()),
+            )
+
+    def flush(self):
+        # patterns are matched while hits are written
+        hits = [(p, n) for p, n in list(self.hits.items()) if n > 0]
+        self.hits.subtract(dict(hits))
+        now = time.time()
+
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "UPDATE patterns SET hits = hits + ?, last_used = ? WHERE source = ? AND pattern = ?",
+                [(n, now, self.source, p) for p, n in hits],
+            )
+            for field, value in self.fields.items():
+                value, before = self._copy(value), self.loaded[field]
+                if value == before:
+                    continue
+                row = db.execute(
+                    "SELECT value FROM fields WHERE source = ? AND field = ?",
+                    (self.source, field),
+                ).fetchone()
+                stored = None if row is None else json.loads(row[0])
+                self.loaded[field] = value
+                if isinstance(value, dict) and isinstance(before, dict):
+                    stored = stored if isinstance(stored, dict) else {}
+                    for key in before.keys() - value.keys():
+                        stored.pop(key, None)
+                    for key in value:
+                        if key not in before or value[key] != before[key]:
+                            stored[key] = value[key]
+                    value = stored
+                db.execute(
+                    "INSERT OR REPLACE INTO fields VALUES (?, ?, ?)",
+                    (self.source, field, json.dumps(value)),
+                )
 
 
 def community_detection(
@@ -162,6 +362,101 @@ def community_detection(
     return unique_communities
 
 
+def approximate_community_detection(
+    embeddings, threshold=0.75, min_community_size=3, batch_size=4096, patience=8
+):
+    """
+    Near-linear alternative to `community_detection`.
+    Embeddings are scanned in batches and compared with the leaders found so far only, an embedding
+    which is not close to any leader becomes a new leader. Leaders still alone after `patience` batches
+    are retired, so outliers don't pile up. Every embedding then joins its most similar leader if they
+    are closer than threshold. Cost is O(n * communities) instead of O(n²). Returns communities in the
+    same shape as `community_detection`, the first element of each is its leader.
+    """
+
+    import numpy
+
+    embeddings = numpy.asarray(embeddings, dtype=numpy.float32)
+    if len(embeddings) == 0:
+        return []
+    norms = numpy.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / numpy.maximum(norms, 1e-12)
+
+    leaders = numpy.empty(0, dtype=numpy.int64)
+    counts = numpy.empty(0, dtype=numpy.int64)
+    born = numpy.empty(0, dtype=numpy.int64)
+
+    # Step 1) Pick leaders
+    for batch_no, start_idx in enumerate(range(0, len(embeddings), batch_size)):
+        batch = embeddings[start_idx : start_idx + batch_size]
+        candidates = numpy.arange(len(batch))
+        if len(leaders) > 0:
+            cos_scores = batch @ embeddings[leaders].T
+            best = cos_scores.argmax(axis=1)
+            close = cos_scores[candidates, best] >= threshold
+            counts += numpy.bincount(best[close], minlength=len(leaders))
+            candidates = candidates[~close]
+
+        if len(candidates) > 0:
+            # greedily cover the rest of the batch with new leaders
+            cos_scores = batch[candidates] @ batch[candidates].T
+            covered = numpy.zeros(len(candidates), dtype=bool)
+            new = []
+            for i in range(len(candidates)):
+                if covered[i]:
+                    continue
+                new.append(i)
+                covered |= cos_scores[i] >= threshold
+
+            leaders = numpy.concatenate([leaders, start_idx + candidates[new]])
+            counts = numpy.concatenate([counts, (cos_scores[new] >= threshold).sum(1)])
+            born = numpy.concatenate([born, numpy.full(len(new), batch_no)])
+
+        keep = (counts > 1) | (born > batch_no - patience)
+        leaders, counts, born = leaders[keep], counts[keep], born[keep]
+
+    if len(leaders) == 0:
+        return []
+
+    # Step 2) Assign every embedding to its most similar leader
+    centers = embeddings[leaders]
+    labels = numpy.empty(len(embeddings), dtype=numpy.int64)
+    for start_idx in range(0, len(embeddings), batch_size):
+        cos_scores = embeddings[start_idx : start_idx + batch_size] @ centers.T
+        best = cos_scores.argmax(axis=1)
+        best[cos_scores[numpy.arange(len(best)), best] < threshold] = -1
+        labels[start_idx : start_idx + batch_size] = best
+
+    order = numpy.argsort(labels, kind="stable")
+    bounds = numpy.flatnonzero(numpy.diff(labels[order])) + 1
+    communities = []
+    for members in numpy.split(order, bounds):
+        label = labels[members[0]]
+        if label < 0 or len(members) < min_community_size:
+            continue
+        leader = int(leaders[label])
+        communities.append([leader] + [i for i in members.tolist() if i != leader])
+
+    return sorted(communities, key=lambda x: len(x), reverse=True)
+
+
+MASKS = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"
+    r"|\b0[xX][0-9a-fA-F]+\b"
+    r"|\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{6,}\b"
+    r"|(?<![\w>])(?:/[\w.\-]+)+/?"
+    r"|\b\d+(?:\.\d+)?"
+)
+
+
+def canonicalize(line: str) -> str:
+    """
+    Masks variables (UUIDs, IPs, hex, paths and numbers) of a log line.
+    """
+    return MASKS.sub("<*>", line)
+
+
 units = {"B": 1, "KB": 2**10, "MB": 2**20, "GB": 2**30, "TB": 2**40}
 
 
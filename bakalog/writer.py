@@ -0,0 +1,591 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import duckdb
+import pyarrow
+from pyarrow import dataset, parquet
+from pypika import Column, Query, Schema, Table
+from pypika.terms import LiteralValue
+
+from .stats import Stats
+from .util import Batch, Log
+
+
+def quote(pattern: str) -> str:
+    return pattern.replace('"', '""')
+
+
+def literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class Type(NamedTuple):
+    name: str
+    # SQL expressions of a column, whether its value has the type and the value casted
+    test: Callable[[str], str]
+    cast: Callable[[str], str]
+    values: Tuple[str, ...] = ()
+
+
+VARCHAR = Type("VARCHAR", lambda c: "true", lambda c: c)
+
+# without leading zeros which would be lost, and in the range of BIGINT
+INTEGER = "[+-]?(0|[1-9][0-9]{0,17})"
+FLOAT = "[+-]?((0|[1-9][0-9]*)([.][0-9]*)?|[.][0-9]+)([eE][+-]?[0-9]+)?"
+IPV4 = "((25[0-5]|2[0-4][0-9]|1?[0-9]?[0-9])[.]){3}(25[0-5]|2[0-4][0-9]|1?[0-9]?[0-9])"
+# ISO 8601 is casted as is, log4j, nginx and apache timestamps are parsed
+TIMESTAMPS = [
+    None,
+    "%Y-%m-%d %H:%M:%S,%g",
+    "%Y/%m/%d %H:%M:%S",
+    "%a %b %d %H:%M:%S %Y",
+]
+
+
+def cast(name: str) -> Type:
+    return Type(
+        name,
+        lambda c: f"TRY_CAST({c} AS {name}) IS NOT NULL",
+        lambda c: f"TRY_CAST({c} AS {name})",
+    )
+
+
+def matches(name: str, regex: str) -> Type:
+    return Type(
+        name,
+        lambda c: f"regexp_full_match({c}, '{regex}')",
+        lambda c: f"TRY_CAST({c} AS {name})",
+    )
+
+
+def strptime(format: str) -> Type:
+    return Type(
+        "TIMESTAMP",
+        lambda c: f"try_strptime({c}, '{format}') IS NOT NULL",
+        lambda c: f"try_strptime({c}, '{format}')",
+    )
+
+
+def enum(values) -> Type:
+    values = tuple(sorted(values))
+    return cast(f"ENUM({', '.join(literal(v) for v in values)})")._replace(
+        values=values
+    )
+
+
+def timestamp(types: List[Type]) -> Optional[str]:
+    """
+    SQL expression of the first timestamp column of a batch.
+    """
+    for id, t in enumerate(types):
+        if t.name == "TIMESTAMP":
+            return t.cast(f'"c{id}"')
+    return None
+
+
+def candidates(inet: bool) -> List[Type]:
+    types = [matches("BIGINT", INTEGER), matches("DOUBLE", FLOAT)]
+    for format in TIMESTAMPS:
+        types.append(cast("TIMESTAMP") if format is None else strptime(format))
+    if inet:
+        types.append(matches("INET", IPV4))
+    return types
+
+
+class Writer:
+    """
+    Buffers rows of each template and bulk loads them into a table per template. Column types are
+    inferred from the first `infer_rows` rows of a template: integers, floats, timestamps, IPs when
+    the inet extension is installed, then enums of up to `max_enum` values seen often enough. Values
+    are casted in the bulk load, a column is widened to VARCHAR, or to a larger enum, once a batch
+    holds a value which doesn't fit.
+
+    With `events`, every row is also indexed in the `events` table by the id of its template in the
+    `templates` table, its first timestamp, source and line number, and its `row` in the table of
+    the template, to query across templates. The timestamp is still parsed as inferred once its
+    column widens. Events are staged and written sorted by time and template in chunks of
+    `events_size` rows, and at each `flush`, so zone maps of DuckDB skip row groups out of a time
+    range.
+    """
+
+    def __init__(
+        self,
+        db: duckdb.DuckDBPyConnection,
+        batch_size: int = 8192,
+        infer_rows: int = 1024,
+        max_enum: int = 64,
+        events: bool = True,
+        events_size: int = 1024 * 1024,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.infer_rows = infer_rows
+        self.max_enum = max_enum
+        self.tables: Set[str] = set()
+        self.types: Dict[str, List[Type]] = {}
+        # SQL expression of the time of events of each template, it stays once its column widens
+        self.times: Dict[str, Optional[str]] = {}
+        self.batches: Dict[str, List[List[str]]] = {}
+        self.pending: Dict[str, int] = {}
+        self.rows = 0
+        self.events = events
+        self.events_size = events_size
+        self.staged = 0
+        # ids of templates and number of rows in their tables
+        self.ids: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+
+        schema = Schema("information_schema")
+        for (name,) in db.execute(
+            Query.from_(schema.tables).select(schema.tables.table_name).get_sql()
+        ).fetchall():
+            self.tables.add(name)
+
+        try:
+            db.load_extension("inet")
+            self.candidates = candidates(inet=True)
+        except duckdb.Error:
+            self.candidates = candidates(inet=False)
+
+        if events:
+            self._events()
+
+    def _events(self):
+        self.db.execute(
+            Query.create_table("templates")
+            .if_not_exists()
+            .columns(Column("id", "integer"), Column("pattern", "varchar"))
+            .primary_key("id")
+            .get_sql()
+        )
+        columns = [
+            Column("template", "integer"),
+            Column("time", "timestamp"),
+            Column("source", "varchar"),
+            Column("lineno", "bigint"),
+            Column("row", "bigint"),
+        ]
+        self.db.execute(
+            Query.create_table("events").if_not_exists().columns(*columns).get_sql()
+        )
+        self.db.execute(
+            Query.create_table("staged_events")
+            .temporary()
+            .if_not_exists()
+            .columns(*columns)
+            .get_sql()
+        )
+        self.ids = dict(self.db.execute("SELECT pattern, id FROM templates").fetchall())
+
+    def append(self, log: Log):
+        columns = self._columns(log.pattern, len(log.groups))
+        for column, value in zip(columns, log.groups):
+            column.append(value)
+        columns[-2].append(log.source)
+        columns[-1].append(log.lineno)
+        self._pending(log.pattern, 1)
+
+    def extend(self, batch: Batch):
+        columns = self._columns(batch.pattern, len(batch.columns))
+        for column, values in zip(columns, batch.columns):
+            column += values
+        columns[-2] += [batch.source] * len(batch)
+        columns[-1] += batch.lineno
+        self._pending(batch.pattern, len(batch))
+
+    def _columns(self, pattern: str, groups: int) -> List[list]:
+        columns = self.batches.get(pattern)
+        if columns is None:
+            # groups, then source and lineno
+            columns = [[] for _ in range(groups + 2)]
+            self.batches[pattern] = columns
+            self.pending[pattern] = 0
+        return columns
+
+    def _pending(self, pattern: str, rows: int):
+        self.pending[pattern] += rows
+        self.rows += rows
+        if self.pending[pattern] >= self.batch_size:
+            self._flush(pattern)
+
+    def flush(self):
+        for pattern in list(self.batches):
+            self._flush(pattern)
+        if self.events:
+            self._move()
+
+    def _flush(self, pattern: str):
+        columns = self.batches.pop(pattern)
+        pending = self.pending.pop(pattern)
+        if pending == 0:
+            return
+        Stats().peak("pending rows", pending)
+
+        *groups, sources, linenos = columns
+        batch = pyarrow.table(
+            {
+                **{
+                    f"c{id}": pyarrow.array(column, type=pyarrow.string())
+                    for id, column in enumerate(groups)
+                },
+                "source": pyarrow.array(sources, type=pyarrow.string()),
+                "lineno": pyarrow.array(linenos, type=pyarrow.int64()),
+            }
+        )
+        self.db.register("batch", batch)
+        try:
+            with Stats().stage("insert"):
+                self._write(pattern, self._types(pattern, len(groups)))
+        finally:
+            self.db.unregister("batch")
+
+    @staticmethod
+    def _select(types: List[Type]) -> List[str]:
+        columns = [f'"c{id}"' for id in range(len(types))]
+        casts = [f"{t.cast(c)} AS {c}" for c, t in zip(columns, types)]
+        return [*casts, "source", "lineno"]
+
+    def _write(self, pattern: str, types: List[Type]):
+        if self.events:
+            self._stage(pattern, types)
+        self.db.execute(
+            Query.into(Table(quote(pattern)))
+            .from_("batch")
+            .select(*[LiteralValue(column) for column in self._select(types)])
+            .get_sql()
+        )
+
+    def _id(self, pattern: str) -> int:
+        id = self.ids.get(pattern)
+        if id is None:
+            id = self.ids[pattern] = len(self.ids)
+            self.db.execute("INSERT INTO templates VALUES (?, ?)", [id, pattern])
+        return id
+
+    def _stage(self, pattern: str, types: List[Type]):
+        id = self._id(pattern)
+        start = self.counts.get(pattern)
+        if start is None:
+            # rows are appended, their row ids are their positions in the table
+            (start,) = self.db.execute(
+                f'SELECT count(*) FROM "{quote(pattern)}"'
+            ).fetchone()
+        (rows,) = self.db.execute(
+            f"INSERT INTO staged_events SELECT {id}, {self.times[pattern] or 'NULL'}, "
+            f"source, lineno, {start} + row_number() OVER () - 1 FROM batch"
+        ).fetchone()
+        self.counts[pattern] = start + rows
+        self._staged(rows)
+
+    def _staged(self, rows: int):
+        self.staged += rows
+        if self.staged >= self.events_size:
+            self._move()
+
+    def _move(self):
+        if self.staged == 0:
+            return
+        with Stats().stage("insert"):
+            self.db.execute(
+                "INSERT INTO events SELECT * FROM staged_events "
+                "ORDER BY time, template, source, lineno"
+            )
+            self.db.execute("DELETE FROM staged_events")
+        self.staged = 0
+
+    def _create(self, pattern: str, types: List[Type]):
+        self.db.sql(
+            Query.create_table(quote(pattern))
+            .columns(
+                *[Column(f"c{id}", t.name) for id, t in enumerate(types)],
+                Column("source", "string"),
+                Column("lineno", "bigint"),
+            )
+            .get_sql()
+        )
+        self.tables.add(pattern)
+
+    def _widen(self, pattern: str, id: int, t: Type):
+        self.db.execute(f'ALTER TABLE "{quote(pattern)}" ALTER "c{id}" TYPE {t.name}')
+
+    def _types(self, pattern: str, groups: int) -> List[Type]:
+        types = self.types.get(pattern)
+        if types is None and pattern in self.tables:
+            types = self.types[pattern] = self._existing(pattern)
+        if types is None:
+            types = self.types[pattern] = self._infer(groups)
+            self.times[pattern] = timestamp(types)
+            self._create(pattern, types)
+            return types
+        if pattern not in self.times:
+            self.times[pattern] = timestamp(types)
+
+        # widen columns which can't hold values of the batch
+        typed = [id for id, t in enumerate(types) if t is not VARCHAR]
+        if len(typed) == 0:
+            return types
+        conflicts = self.db.execute(
+            f"SELECT {', '.join(self._conflict(id, types[id]) for id in typed)} FROM batch"
+        ).fetchone()
+        for id, conflict in zip(typed, conflicts):
+            if conflict == 0:
+                continue
+            widened = VARCHAR
+            if types[id].values:
+                values = set(types[id].values) | self._distinct(id, "batch")
+                if len(values) <= self.max_enum:
+                    widened = enum(values)
+            logging.warning(
+                f"{conflict} values of c{id} of {pattern} aren't {types[id].name}, "
+                f"widen it to {widened.name}."
+            )
+            if self.times[pattern] == types[id].cast(f'"c{id}"'):
+                # values are still parsed as before, those which don't fit have no time
+                logging.warning(f"{conflict} events of {pattern} have no time.")
+            self._widen(pattern, id, widened)
+            types[id] = widened
+        return types
+
+    @staticmethod
+    def _conflict(id: int, t: Type) -> str:
+        column = f'"c{id}"'
+        return f"count_if({column} IS NOT NULL AND NOT ({t.test(column)}))"
+
+    def _distinct(self, id: int, table: str) -> Set[str]:
+        rows = self.db.execute(
+            f'SELECT DISTINCT "c{id}" FROM {table} WHERE "c{id}" IS NOT NULL'
+        ).fetchall()
+        return {value for (value,) in rows}
+
+    def _infer(self, groups: int) -> List[Type]:
+        if self.infer_rows <= 0 or groups == 0:
+            return [VARCHAR] * groups
+
+        sample = f"(SELECT * FROM batch LIMIT {self.infer_rows})"
+        counts = []
+        for id in range(groups):
+            column = f'"c{id}"'
+            counts += [f"count({column})", f"count(DISTINCT {column})"]
+            counts += [f"count_if({t.test(column)})" for t in self.candidates]
+        counts = self.db.execute(f"SELECT {', '.join(counts)} FROM {sample}").fetchone()
+
+        types = []
+        width = len(self.candidates) + 2
+        for id in range(groups):
+            n, distinct, *fits = counts[id * width : (id + 1) * width]
+            found = next(
+                (t for t, fit in zip(self.candidates, fits) if n > 0 and fit == n), None
+            )
+            # enough repeats of a few values
+            if found is None and 0 < distinct <= self.max_enum and n >= 8 * distinct:
+                found = enum(self._distinct(id, sample))
+            types.append(found or VARCHAR)
+        return types
+
+    def _existing(self, pattern: str) -> List[Type]:
+        schema = Schema("information_schema")
+        rows = self.db.execute(
+            Query.from_(schema.columns)
+            .select(schema.columns.column_name, schema.columns.data_type)
+            .where(schema.columns.table_name == pattern)
+            .orderby(schema.columns.ordinal_position)
+            .get_sql()
+        ).fetchall()
+        return [
+            self._stored(id, name)
+            for id, name in enumerate(
+                name for column, name in rows if column.startswith("c")
+            )
+        ]
+
+    def _stored(self, id: int, name: str) -> Type:
+        """
+        The type a column was inferred as from its SQL type, timestamps take the first format which
+        fits the batch, as formats aren't stored.
+        """
+        if name == "VARCHAR":
+            return VARCHAR
+        if name.startswith("ENUM("):
+            values = self.db.execute(
+                f"SELECT unnest(enum_range(NULL::{name}))"
+            ).fetchall()
+            return enum(value for (value,) in values)
+
+        found = [t for t in self.candidates if t.name == name]
+        if len(found) > 1:
+            fits = self.db.execute(
+                f"SELECT {', '.join(self._conflict(id, t) for t in found)} FROM batch"
+            ).fetchone()
+            found = [t for t, conflict in zip(found, fits) if conflict == 0] or found
+        return found[0] if found else cast(name)
+
+
+def report(rows: int, started: float):
+    elapsed = time.perf_counter() - started
+    logging.info(
+        f"collected {rows} logs in {format(elapsed, '.2f')}s, "
+        f"{format(rows / max(elapsed, 1e-9), '.2f')} rows/s."
+    )
+
+
+class ParquetWriter(Writer):
+    """
+    Writes each template as a Parquet dataset in its own directory under `path`, one file per
+    flushed batch, hive partitioned by `partition_by`: `source` by the `file` name of logs, or the
+    `hour` or `day` of the first timestamp column. Values are casted as `Writer` does, a widened column only applies to later
+    files. `templates.parquet` maps directories to patterns and their ids, and `db` has a view of
+    each dataset.
+
+    With `events`, the `events` dataset indexes rows as the `events` table of `Writer` does, in files
+    of sorted chunks. It has no `row`, rows of a template are found by `source` and `lineno`.
+    """
+
+    PARTITIONS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d"}
+
+    def __init__(
+        self,
+        path: str,
+        partition_by: Optional[str] = None,
+        batch_size: int = 8192,
+        infer_rows: int = 1024,
+        max_enum: int = 64,
+        events: bool = True,
+        events_size: int = 1024 * 1024,
+    ):
+        super().__init__(
+            duckdb.connect(), batch_size, infer_rows, max_enum, events, events_size
+        )
+        self.path = path
+        self.partition_by = partition_by
+        # files of different runs don't overwrite each other
+        self.run = uuid.uuid4().hex[:8]
+        self.parts = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.templates: Dict[str, str] = {}
+        if os.path.exists(self._path("templates.parquet")):
+            table = parquet.read_table(self._path("templates.parquet")).to_pydict()
+            self.templates = dict(zip(table["name"], table["pattern"]))
+            # written before templates had ids
+            ids = table.get("id") or range(len(table["pattern"]))
+            self.ids = dict(zip(table["pattern"], ids))
+
+    def _events(self):
+        self.db.execute(
+            Query.create_table("staged_events")
+            .temporary()
+            .columns(
+                Column("template", "integer"),
+                Column("time", "timestamp"),
+                Column("source", "varchar"),
+                Column("lineno", "bigint"),
+            )
+            .get_sql()
+        )
+
+    def _id(self, pattern: str) -> int:
+        id = self.ids.get(pattern)
+        if id is None:
+            id = self.ids[pattern] = len(self.ids)
+        return id
+
+    def _stage(self, pattern: str, types: List[Type]):
+        (rows,) = self.db.execute(
+            f"INSERT INTO staged_events SELECT {self._id(pattern)}, "
+            f"{self.times[pattern] or 'NULL'}, source, lineno FROM batch"
+        ).fetchone()
+        self._staged(rows)
+
+    def _move(self):
+        if self.staged == 0:
+            return
+        with Stats().stage("insert"):
+            table = self.db.execute(
+                "SELECT * FROM staged_events ORDER BY time, template, source, lineno"
+            ).arrow()
+            self.parts += 1
+            os.makedirs(self._path("events"), exist_ok=True)
+            parquet.write_table(
+                table, self._path("events", f"part-{self.run}-{self.parts}.parquet")
+            )
+            self.db.execute("DELETE FROM staged_events")
+        self.staged = 0
+
+    def _path(self, *names: str) -> str:
+        return os.path.join(self.path, *names)
+
+    @staticmethod
+    def name(pattern: str) -> str:
+        return hashlib.sha1(pattern.encode()).hexdigest()[:16]
+
+    def _create(self, pattern: str, types: List[Type]):
+        self.tables.add(pattern)
+        self.templates[self.name(pattern)] = pattern
+
+    def _widen(self, pattern: str, id: int, t: Type):
+        pass
+
+    def _write(self, pattern: str, types: List[Type]):
+        if self.events:
+            self._stage(pattern, types)
+        columns, partitioning = self._select(types), []
+        if self.partition_by == "source":
+            # paths can't be directory names, `source` keeps the full path
+            columns.append("regexp_extract(source, '[^/]*$') AS file")
+            partitioning = ["file"]
+        elif self.partition_by in self.PARTITIONS:
+            bucket = "NULL::VARCHAR"
+            column = self.times[pattern]
+            if column is not None:
+                bucket = f"strftime({column}, '{self.PARTITIONS[self.partition_by]}')"
+            columns.append(f"{bucket} AS {self.partition_by}")
+            partitioning = [self.partition_by]
+
+        table = self.db.execute(f"SELECT {', '.join(columns)} FROM batch").arrow()
+        self.parts += 1
+        dataset.write_dataset(
+            table,
+            self._path(self.name(pattern)),
+            format="parquet",
+            partitioning=partitioning,
+            partitioning_flavor="hive",
+            basename_template=f"part-{self.run}-{self.parts}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+
+    def flush(self):
+        super().flush()
+        table = pyarrow.table(
+            {
+                "name": list(self.templates.keys()),
+                "pattern": list(self.templates.values()),
+                "id": pyarrow.array(
+                    [self._id(pattern) for pattern in self.templates.values()],
+                    type=pyarrow.int32(),
+                ),
+            }
+        )
+        parquet.write_table(table, self._path("templates.parquet.tmp"))
+        os.replace(self._path("templates.parquet.tmp"), self._path("templates.parquet"))
+
+        for name, pattern in self.templates.items():
+            files = self._path(name, "**", "*.parquet").replace("'", "''")
+            self.db.execute(
+                f'CREATE OR REPLACE VIEW "{quote(pattern)}" AS SELECT * FROM '
+                f"read_parquet('{files}', hive_partitioning = 1, union_by_name = 1)"
+            )
+        if os.path.exists(self._path("events")):
+            files = self._path("events", "*.parquet").replace("'", "''")
+            self.db.execute(
+                f"CREATE OR REPLACE VIEW events AS SELECT * FROM read_parquet('{files}')"
+            )
+            files = self._path("templates.parquet").replace("'", "''")
+            self.db.execute(
+                f"CREATE OR REPLACE VIEW templates AS SELECT * FROM read_parquet('{files}')"
+            )
@@ -0,0 +1,117 @@
+"""
+Compares `community_detection` with `approximate_community_detection` on synthetic embeddings.
+
+    python benchmarks/community.py [--sizes 10000,100000,1000000] [--exact-max 100000]
+
+Embeddings are drawn around random template centers with a share of unrelated noise. Quality is the
+adjusted Rand index against the generated templates and, where the exact engine ran, against it.
+The exact engine needs torch and sentence-transformers and is skipped above --exact-max lines.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+# runs from a checkout without installing bakalog
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bakalog.util import approximate_community_detection
+
+
+def synthetic(n, dim=384, templates=200, noise=0.05, seed=0):
+    rng = numpy.random.default_rng(seed)
+    centers = rng.standard_normal(size=(templates, dim), dtype=numpy.float32)
+    labels = rng.integers(0, templates, n)
+    embeddings = numpy.empty((n, dim), dtype=numpy.float32)
+    for start in range(0, n, 65536):
+        chunk = embeddings[start : start + 65536]
+        rng.standard_normal(out=chunk, dtype=numpy.float32)
+        chunk *= 0.25
+        chunk += centers[labels[start : start + 65536]]
+
+    outliers = rng.random(n) < noise
+    embeddings[outliers] = rng.standard_normal(
+        size=(outliers.sum(), dim), dtype=numpy.float32
+    )
+    labels[outliers] = -1
+    return embeddings, labels
+
+
+def labels_of(communities, n):
+    labels = numpy.full(n, -1)
+    for label, community in enumerate(communities):
+        labels[community] = label
+    return labels
+
+
+def adjusted_rand_index(a, b):
+    # unassigned points are singletons
+    a = numpy.where(a < 0, numpy.arange(len(a)) + a.max() + 1, a)
+    b = numpy.where(b < 0, numpy.arange(len(b)) + b.max() + 1, b)
+    _, a = numpy.unique(a, return_inverse=True)
+    _, b = numpy.unique(b, return_inverse=True)
+
+    pairs = numpy.unique(a * (b.max() + 1) + b, return_counts=True)[1]
+
+    def comb(x):
+        return (x * (x - 1) / 2).sum()
+
+    index = comb(pairs)
+    rows, cols = comb(numpy.bincount(a)), comb(numpy.bincount(b))
+    expected = rows * cols / comb(numpy.array([len(a)]))
+    maximum = (rows + cols) / 2
+    return (index - expected) / (maximum - expected)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--exact-max", default=100000, type=int)
+    parser.add_argument("--threshold", default=0.85, type=float)
+    args = parser.parse_args()
+
+    try:
+        import torch
+
+        from bakalog.util import community_detection
+    except ImportError:
+        community_detection = None
+
+    print(
+        f"{'lines':>8} {'engine':<12}{'seconds':>10}{'clusters':>10}{'ARI':>8}{'vs exact':>10}"
+    )
+    for n in [int(size) for size in args.sizes.split(",")]:
+        embeddings, truth = synthetic(n)
+
+        exact = None
+        if community_detection is not None and n <= args.exact_max:
+            started = time.perf_counter()
+            communities = community_detection(
+                torch.from_numpy(embeddings), threshold=args.threshold
+            )
+            elapsed = time.perf_counter() - started
+            exact = labels_of(communities, n)
+            print(
+                f"{n:>8} {'exact':<12}{elapsed:>10.2f}{len(communities):>10}"
+                f"{adjusted_rand_index(truth, exact):>8.3f}{'':>10}"
+            )
+
+        started = time.perf_counter()
+        communities = approximate_community_detection(
+            embeddings, threshold=args.threshold
+        )
+        elapsed = time.perf_counter() - started
+        approximate = labels_of(communities, n)
+        agreement = (
+            "" if exact is None else f"{adjusted_rand_index(exact, approximate):.3f}"
+        )
+        print(
+            f"{n:>8} {'approximate':<12}{elapsed:>10.2f}{len(communities):>10}"
+            f"{adjusted_rand_index(truth, approximate):>8.3f}{agreement:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the throughput of `Sink` on plain and compressed copies of a log file.
+
+    python benchmarks/decompress.py [LOG_FILE]
+
+A synthetic Apache-style log is generated when no file is given.
+"""
+import bz2
+import gzip
+import lzma
+import os
+import sys
+import tempfile
+import time
+
+# runs from a checkout without installing bakalog
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bakalog import Sink
+
+
+def synthetic(path, lines=500_000):
+    with open(path, "w") as f:
+        for i in range(lines):
+            f.write(
+                f"[Sun Dec 04 04:51:{i % 60:02d} 2005] [notice] jk2_init() "
+                f"Found child {i} in scoreboard slot {i % 10}\n"
+            )
+
+
+def compressors():
+    yield "gzip", ".gz", lambda data: gzip.compress(data, compresslevel=6)
+    yield "bz2", ".bz2", bz2.compress
+    yield "xz", ".xz", lzma.compress
+    try:
+        import zstandard
+
+        yield "zstd", ".zst", zstandard.ZstdCompressor().compress
+    except ImportError:
+        pass
+
+
+def measure(path, reader):
+    started = time.perf_counter()
+    lines = sum(1 for line in Sink(path, reader=reader) if line is not None)
+    return lines, time.perf_counter() - started
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        if len(sys.argv) > 1:
+            plain = sys.argv[1]
+        else:
+            plain = os.path.join(tmp, "apache.log")
+            synthetic(plain)
+
+        with open(plain, "rb") as f:
+            data = f.read()
+        size = len(data) / 1024 / 1024
+
+        files = [("plain", plain)]
+        for name, suffix, compress in compressors():
+            path = os.path.join(tmp, f"apache.log{suffix}")
+            with open(path, "wb") as f:
+                f.write(compress(data))
+            files.append((name, path))
+
+        print(f"{size:.1f}MB of logs")
+        print(f"{'format':<8}{'reader':<8}{'seconds':>10}{'MB/s':>10}{'penalty':>10}")
+        for reader in ("text", "mmap"):
+            baseline = None
+            for name, path in files:
+                lines, elapsed = measure(path, reader)
+                baseline = baseline or elapsed
+                print(
+                    f"{name:<8}{reader:<8}{elapsed:>10.2f}{size / elapsed:>10.1f}"
+                    f"{elapsed / baseline:>9.2f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
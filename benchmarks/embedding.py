@@ -0,0 +1,131 @@
+"""
+Compares embedding backends of `Cluster` on synthetic logs.
+
+    python benchmarks/embedding.py [--lines 20000] [--backends torch,onnx,onnx-int8]
+        [--engines exact,approximate] [--max-seq-length 0]
+
+Logs are drawn from templates with random variables. Each backend embeds them, torch through its
+process pool, then communities are detected by each engine of `Cluster`, `exact` being its default.
+Throughput is logs embedded per second, agreement is the mean cosine similarity with the embeddings
+of the first backend and the adjusted Rand index of communities against the templates and against
+the first backend with the same engine.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy
+
+# runs from a checkout without installing bakalog
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bakalog.cluster import MODEL
+from bakalog.embedding import load
+from bakalog.util import approximate_community_detection, community_detection
+from benchmarks.community import adjusted_rand_index, labels_of
+
+ENGINES = {"exact": community_detection, "approximate": approximate_community_detection}
+
+TEMPLATES = [
+    "Accepted password for {user} from {ip} port {port} ssh2",
+    "Failed password for invalid user {user} from {ip} port {port} ssh2",
+    "Connection closed by {ip} port {port} [preauth]",
+    "GET /api/v1/{path}/{id} HTTP/1.1 200 {size} {ms}ms",
+    "POST /api/v1/{path} HTTP/1.1 500 {size} {ms}ms",
+    "worker {id} finished job {uuid} in {ms} ms",
+    "disk /dev/sd{letter} usage at {percent}% on {host}",
+    "kernel: Out of memory: Killed process {id} ({user}) total-vm:{size}kB",
+    "session {uuid} opened for user {user} by (uid={id})",
+    "cache miss for key {path}:{id}, fetching from {host}",
+]
+
+
+def synthetic(n, seed=0):
+    rng = random.Random(seed)
+    lines, labels = [], []
+    for _ in range(n):
+        label = rng.randrange(len(TEMPLATES))
+        lines.append(
+            TEMPLATES[label].format(
+                user=rng.choice(["root", "admin", "deploy", "alice", "bob"]),
+                ip=".".join(str(rng.randrange(256)) for _ in range(4)),
+                port=rng.randrange(1024, 65536),
+                path=rng.choice(["users", "orders", "items", "carts"]),
+                id=rng.randrange(100000),
+                size=rng.randrange(100000),
+                ms=rng.randrange(1000),
+                uuid=f"{rng.getrandbits(128):032x}",
+                letter=rng.choice("abcd"),
+                percent=rng.randrange(100),
+                host=f"node-{rng.randrange(64)}",
+            )
+        )
+        labels.append(label)
+    return lines, numpy.array(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", default=20000, type=int)
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--engines", default="exact,approximate")
+    parser.add_argument("--max-seq-length", default=0, type=int)
+    parser.add_argument("--threshold", default=0.85, type=float)
+    args = parser.parse_args()
+
+    lines, truth = synthetic(args.lines)
+    print(
+        f"{'backend':<12}{'engine':<12}{'load s':>8}{'logs/s':>10}{'detect s':>10}"
+        f"{'cosine':>8}{'ARI':>8}{'vs first':>10}"
+    )
+    first = None
+    for backend in args.backends.split(","):
+        started = time.perf_counter()
+        model = load(MODEL, backend, args.max_seq_length or None)
+        pool = model.start_multi_process_pool()
+        loaded = time.perf_counter() - started
+        try:
+            # warm up
+            model.encode_multi_process(lines[:64], pool)
+            started = time.perf_counter()
+            embeddings = numpy.asarray(
+                model.encode_multi_process(lines, pool), dtype=numpy.float32
+            )
+            elapsed = time.perf_counter() - started
+        finally:
+            model.stop_multi_process_pool(pool)
+
+        cosine = ""
+        if first is None:
+            first = embeddings, {}
+        else:
+            cosine = f"{(embeddings * first[0]).sum(axis=1).mean():.4f}"
+        for engine in args.engines.split(","):
+            data = embeddings
+            if engine == "exact":
+                # needs torch, the ONNX backends don't
+                import torch
+
+                data = torch.from_numpy(embeddings)
+            started = time.perf_counter()
+            communities = ENGINES[engine](data, threshold=args.threshold)
+            detected = time.perf_counter() - started
+            labels = labels_of(communities, len(lines))
+
+            agreement = ""
+            if engine in first[1]:
+                agreement = f"{adjusted_rand_index(first[1][engine], labels):.3f}"
+            else:
+                first[1][engine] = labels
+            print(
+                f"{backend:<12}{engine:<12}{loaded:>8.2f}{len(lines) / elapsed:>10.1f}"
+                f"{detected:>10.2f}{cosine:>8}{adjusted_rand_index(truth, labels):>8.3f}"
+                f"{agreement:>10}"
+            )
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    main()
@@ -0,0 +1,87 @@
+"""
+Measures how long modules of bakalog take to import with `python -X importtime`.
+
+    python benchmarks/importtime.py [--runs 5] [--check] [--max-ms 0]
+
+Each module is imported in a fresh interpreter, the median of the cumulative import time is
+reported with the heavy dependencies it pulled in. With --check it fails when a module imports a
+dependency it should only load once a command needs it, or takes over --max-ms milliseconds. The
+test suite checks the heavy dependencies in tests/test_imports.py.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY = {
+    "duckdb",
+    "IPython",
+    "numpy",
+    "openai",
+    "pyarrow",
+    "pypika",
+    "rich",
+    "sentence_transformers",
+    "torch",
+}
+
+# modules and the heavy dependencies they may import
+MODULES = {
+    "bakalog": set(),
+    "bakalog.__main__": set(),
+    "bakalog.client": set(),
+    "bakalog.drain": set(),
+    "bakalog.cluster": {"numpy"},
+}
+
+
+def importtime(module):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "PYTHONPATH": root},
+    )
+    imported, total = set(), 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        imported.add(name.split(".")[0])
+        if name == module and cumulative.strip().isdigit():
+            total = int(cumulative) / 1000
+    return total, imported & HEAVY
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", default=5, type=int)
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--max-ms", default=0, type=float)
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<20}{'ms':>10}  heavy dependencies")
+    for module, allowed in MODULES.items():
+        runs = [importtime(module) for _ in range(args.runs)]
+        elapsed = statistics.median(t for t, _ in runs)
+        heavy = set().union(*(h for _, h in runs))
+        print(f"{module:<20}{elapsed:>10.1f}  {', '.join(sorted(heavy)) or '-'}")
+
+        if heavy - allowed:
+            print(f"  {module} imports {', '.join(sorted(heavy - allowed))}")
+            failed = True
+        if args.max_ms > 0 and elapsed > args.max_ms:
+            print(f"  {module} takes over {args.max_ms}ms")
+            failed = True
+
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+
+import pytest
+
+from bakalog import Sink
+from bakalog.checkpoint import Checkpoints
+
+
+def write(path, text, mode="w"):
+    with open(path, mode) as f:
+        f.write(text)
+
+
+def read(path, files, take=None, holders=()):
+    """
+    Reads lines of `path` with checkpoints kept in `files`, at most `take` of them, and commits.
+    Returns the lines with their line numbers.
+    """
+    sink = Sink(str(path), checkpoints=Checkpoints(files))
+    sink.holders.extend(holders)
+    lines = []
+    for line in sink:
+        if line is None:
+            continue
+        lines.append((line, sink.lineno))
+        if take is not None and len(lines) == take:
+            break
+    sink.checkpoint()
+    return lines
+
+
+class Holder:
+    def __init__(self, origins):
+        self.origins = origins
+
+    def held(self):
+        return self.origins
+
+
+@pytest.fixture
+def files():
+    return {}
+
+
+def test_resume_appended(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb 2\n")
+    assert read(log, files) == [("a 1", 1), ("b 2", 2)]
+    assert read(log, files) == []
+
+    write(log, "c 3\n", "a")
+    assert read(log, files) == [("c 3", 3)]
+    assert files[str(log)]["offset"] == os.path.getsize(log)
+
+
+def test_resume_in_the_middle_of_a_block(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "".join(f"line {i}\n" for i in range(1, 6)))
+    assert read(log, files, take=2) == [("line 1", 1), ("line 2", 2)]
+    assert files[str(log)]["offset"] == len("line 1\nline 2\n")
+    assert not files[str(log)]["complete"]
+
+    assert [n for _, n in read(log, files)] == [3, 4, 5]
+
+
+def test_rotation_by_inode(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb 2\n")
+    read(tmp_path / "a.log*", files)
+
+    rotated = tmp_path / "a.log.1"
+    write(log, "c 3\n", "a")
+    os.rename(log, rotated)
+    write(log, "new 1\n")
+
+    lines = read(tmp_path / "a.log*", files)
+    assert sorted(lines) == [("c 3", 3), ("new 1", 1)]
+    assert files[str(rotated)]["inode"] == os.stat(rotated).st_ino
+    assert files[str(log)]["inode"] == os.stat(log).st_ino
+
+
+def test_truncated(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb 2\n")
+    read(log, files)
+
+    write(log, "c\n")
+    assert read(log, files) == [("c", 1)]
+
+
+def test_replaced_in_place(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb 2\n")
+    read(log, files)
+
+    # same inode and a longer file, but the head is different
+    write(log, "x 1\ny 2\nz 3\n")
+    assert read(log, files) == [("x 1", 1), ("y 2", 2), ("z 3", 3)]
+
+
+def test_partial_last_line(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb 2\nc 3")
+    assert read(log, files) == [("a 1", 1), ("b 2", 2)]
+    assert not files[str(log)]["complete"]
+
+    # the file didn't change since, the partial line is final
+    assert read(log, files) == [("c 3", 3)]
+    assert files[str(log)]["complete"]
+    assert read(log, files) == []
+
+    # the rest of the line read as final is skipped
+    write(log, "x\nd 4\n", "a")
+    assert read(log, files) == [("d 4", 4)]
+
+
+def test_partial_last_line_completed_later(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb")
+    assert read(log, files) == [("a 1", 1)]
+
+    write(log, " 2\n", "a")
+    assert read(log, files) == [("b 2", 2)]
+
+
+def test_settled(tmp_path):
+    log = tmp_path / "a.log"
+    write(log, "a 1\n")
+    checkpoints = Checkpoints({})
+    assert not checkpoints.settled(str(log))
+
+    checkpoints.done(str(log), 4, 1, True)
+    assert checkpoints.settled(str(log))
+    checkpoints.commit()
+    assert checkpoints.settled(str(log))
+    assert not Checkpoints(checkpoints.files, resume=False).settled(str(log))
+
+    write(log, "b 2\n", "a")
+    assert not checkpoints.settled(str(log))
+
+
+def test_held_lines_stop_checkpoints(tmp_path, files):
+    log = tmp_path / "a.log"
+    write(log, "".join(f"line {i}\n" for i in range(1, 6)))
+    holder = Holder([(str(log), 4), (str(log), 2), (None, None)])
+    read(log, files, holders=[holder])
+    assert files[str(log)]["lineno"] == 1
+    assert files[str(log)]["offset"] == len("line 1\n")
+    assert not files[str(log)]["complete"]
+
+    assert [n for _, n in read(log, files)] == [2, 3, 4, 5]
+
+
+def test_held_lines_of_recycled_logs(tmp_path):
+    log = tmp_path / "a.log"
+    write(log, "a 1\nb 2\n")
+    sink = Sink(str(log), checkpoints=Checkpoints({}))
+    sink.holders.append(Holder([(str(log), 2)]))
+    sink.send(["a 1"], [(str(log), 1)])
+    sink.send(["sampled"])
+    assert sink.held() == {str(log): 1}
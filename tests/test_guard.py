@@ -0,0 +1,52 @@
+import re
+import time
+
+from bakalog.guard import prefixes, pumped, review, tighten
+
+BUDGET = 100e-6
+
+
+def test_accepts_a_linear_pattern():
+    samples = [
+        "2023-01-05 INFO worker-2 processed request 267460 in 121 ms",
+        "2023-01-06 INFO worker-3 processed request 1 in 1 ms",
+        "2023-01-07 INFO worker-1 processed request 22 in 9 ms",
+    ]
+    pattern = re.compile(
+        r"^(\S+) INFO worker-(\d) processed request (\d+) in (\d+) ms$"
+    )
+    _, problem = review(pattern, samples, samples * 64, BUDGET)
+    assert problem is None
+
+
+def test_rejects_a_pattern_which_does_not_match_its_samples():
+    _, problem = review(re.compile(r"^(\d+)$"), ["a1"], [], BUDGET)
+    assert problem.startswith("the pattern doesn't match")
+
+
+def test_rejects_polynomial_backtracking_on_a_long_holdout_line():
+    pattern = re.compile(r"^(.+)(.+)(.+)(.+)x$")
+    started = time.perf_counter()
+    _, problem = review(pattern, ["abcdx", "abcdex", "aaaaax"], ["y" * 500], BUDGET)
+    assert "backtracks" in problem
+    assert time.perf_counter() - started < 5
+
+
+def test_rejects_nested_quantifiers_on_short_samples():
+    _, problem = review(re.compile(r"^(a+)+$"), ["aaa", "aa", "aaaa"], [], BUDGET)
+    assert "backtracks" in problem
+
+
+def test_pumped():
+    lines = pumped(["ab cd"], step=2, longest=2)
+    assert lines == ["aaab cd\0", "ab cccd\0"]
+
+
+def test_prefixes():
+    assert prefixes(["x" * 40], shortest=16) == ["x" * 16, "x" * 32, "x" * 40]
+    assert prefixes([]) == []
+
+
+def test_tighten():
+    pattern = tighten(re.compile(r"^\[(.+)\] (.+) took (.+)ms$"), ["[a] b took 12ms"])
+    assert pattern.pattern == r"^\[([^\]]+)\] ([^\ ]+) took (\d+)ms$"
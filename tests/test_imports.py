@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+HEAVY = ["duckdb", "pyarrow", "sentence_transformers", "torch"]
+
+
+@pytest.mark.parametrize("module", ["bakalog", "bakalog.__main__"])
+def test_heavy_dependencies_are_loaded_lazily(module):
+    # in a fresh interpreter, modules imported by other tests don't count
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; "
+            f"print(*sorted(m for m in {HEAVY!r} if m in sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    assert result.stdout.split() == []
@@ -0,0 +1,73 @@
+import random
+import re
+
+from bakalog.index import Index, literals
+
+PATTERNS = [
+    re.compile(r"^GET /api/v1/(\d+)$"),
+    re.compile(r"^(GET|POST) /api/v1/(\w+)$"),
+    re.compile(r"^(?:\[\w+\] )?GET /(\S+)$"),
+    re.compile(r"^get /api/(\S+)$", re.IGNORECASE),
+    re.compile(r"^(?i:post) /(\S+)$"),
+    re.compile(r"(?i)^put /(\S+)$"),
+    re.compile(r"^GET /api/v1/(\d+) took (\d+) ms$"),
+    re.compile(r"^(\S+) timeout after (\d+) ms$"),
+    re.compile(r"^GET /(?!api)(\S+)$"),
+    re.compile(r"^\[(\w+)\] (.*)$"),
+    re.compile(r"^(.*)$"),
+]
+
+PREFIXES = ["", "", "", "[web] ", "[db]", "x "]
+METHODS = ["GET", "get", "POST", "Post", "PUT", "put", "DELETE"]
+PATHS = ["/api/v1/42", "/api/v1/users", "/API/v1/42", "/users", "/", "api"]
+SUFFIXES = ["", "", "", " took 7 ms", " took x ms", " timeout after 3 ms", " "]
+
+
+def linear(patterns, line, start=0):
+    for pattern in patterns[start:]:
+        match = pattern.match(line)
+        if match is not None:
+            return pattern, match.groups()
+    return None
+
+
+def indexed(index, line, start=0):
+    found = index.match(line, start)
+    return found and (found[0], found[1].groups())
+
+
+def lines(n=2000, seed=0):
+    rng = random.Random(seed)
+    yield from ["", " ", "db timeout after 3 ms", "GET /api/v1/42 took 7 ms"]
+    for _ in range(n):
+        parts = [PREFIXES, METHODS, [" "], PATHS, SUFFIXES]
+        yield "".join(rng.choice(choices) for choices in parts)
+
+
+def test_matches_the_first_pattern_as_a_linear_scan():
+    index = Index(PATTERNS)
+    for line in lines():
+        for start in range(len(PATTERNS) + 1):
+            assert indexed(index, line, start) == linear(PATTERNS, line, start), line
+
+
+def test_generations_of_added_patterns():
+    # lines already matched against the first patterns only try those added since
+    index = Index()
+    for generation, pattern in enumerate(PATTERNS):
+        index.add(pattern)
+        for line in lines(200, seed=generation):
+            assert indexed(index, line, generation) == linear(
+                PATTERNS[: generation + 1], line, generation
+            )
+
+
+def test_literals():
+    assert literals(re.compile(r"^GET /api/v1/(\d+) took")) == (
+        "GET /api/v1/",
+        ["GET /api/v1/", " took"],
+    )
+    assert literals(re.compile(r"^(?:\[\w+\] )?GET /(\S+)$")) == ("", ["GET /"])
+    assert literals(re.compile(r"^(GET|POST) /x")) == ("", [" /x"])
+    assert literals(re.compile(r"^(?i:get) /x")) == ("", [" /x"])
+    assert literals(re.compile(r"^get /x", re.IGNORECASE)) == ("", [])
@@ -0,0 +1,23 @@
+from bakalog.util import Arena
+
+
+def test_arena_pops_lines_in_lifo_order():
+    arena = Arena()
+    lines = [
+        ("a 1", "a.log", 1, 0),
+        ("", "a.log", 2, 3),
+        ("héllo \udcff", None, None, 1),
+        ("b 1", "b.log", 0, 2),
+    ]
+    for line in lines:
+        arena.append(*line)
+    assert len(arena) == 4
+    assert list(arena.origins()) == [(s, n) for _, s, n, _ in lines]
+
+    popped = [arena.pop() for _ in range(len(lines))]
+    assert popped == lines[::-1]
+    assert len(arena) == 0 and len(arena.data) == 0
+
+    arena.append("c", "c.log", 5)
+    assert arena.sources == [None, "c.log"]
+    assert arena.pop() == ("c", "c.log", 5, 0)
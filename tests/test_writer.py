@@ -0,0 +1,50 @@
+import duckdb
+
+from bakalog.util import Log
+from bakalog.writer import Writer
+
+PATTERN = r"^(\S+) (\S+)$"
+
+
+def write(writer, rows, start=1):
+    for lineno, groups in enumerate(rows, start):
+        writer.append(Log(PATTERN, "", groups, "a.log", lineno))
+    writer.flush()
+
+
+def types(db):
+    rows = db.execute(
+        "SELECT column_name, data_type FROM information_schema.columns "
+        f"WHERE table_name = '{PATTERN}' AND column_name LIKE 'c%'"
+    ).fetchall()
+    return dict(rows)
+
+
+def test_widens_columns_which_do_not_fit():
+    db = duckdb.connect()
+    writer = Writer(db, infer_rows=16, max_enum=2)
+    write(writer, [(str(i), "GET") for i in range(16)])
+    assert types(db) == {"c0": "BIGINT", "c1": "ENUM('GET')"}
+
+    write(writer, [("x", "PUT")], start=17)
+    assert types(db) == {"c0": "VARCHAR", "c1": "ENUM('GET', 'PUT')"}
+    write(writer, [("1", "POST")], start=18)
+    assert types(db)["c1"] == "VARCHAR"
+
+    rows = db.execute(f'SELECT c0, c1 FROM "{PATTERN}" WHERE lineno >= 16').fetchall()
+    assert rows == [("15", "GET"), ("x", "PUT"), ("1", "POST")]
+
+
+def test_events_keep_their_time_once_the_timestamp_column_widens():
+    db = duckdb.connect()
+    writer = Writer(db, infer_rows=16)
+    write(writer, [(f"2023/01/05 10:00:{i:02}", "a") for i in range(16)])
+    assert types(db)["c0"] == "TIMESTAMP"
+
+    write(writer, [("2023/01/05 10:01:00", "b"), ("later", "c")], start=17)
+    assert types(db)["c0"] == "VARCHAR"
+    times = db.execute(
+        "SELECT lineno, strftime(time, '%H:%M:%S') FROM events WHERE lineno > 15 "
+        "ORDER BY lineno"
+    ).fetchall()
+    assert times == [(16, "10:00:15"), (17, "10:01:00"), (18, None)]